@@ -0,0 +1,166 @@
+# batch.py
+#
+# EnesGUL12, dr-dobermann, 2018.
+#
+# https://github.com/EnesGUL12/LifeCells.git
+#
+# Пакетный запуск пространств из библиотеки colony.py
+#
+# Каждое задание пакета - это пространство из файла LCSF либо созданное
+# функцией-генератором, и число random.seed, от которого зависят случайные
+# координаты колоний. Задания выполняются в пуле процессов без вывода
+# пространства по дням. По каждому заданию собирается итог: возраст
+# пространства, число колоний, число живых клеток и время расчета.
+# Итоги всех заданий записываются в один CSV файл по мере их получения.
+#
+# Запуск из командной строки:
+#   python batch.py [-d DAYS] [-e ENGINE] [-s SEEDS] [-w WORKERS]
+#                   [-o RESULTS] file [file ...]
+
+import argparse
+import csv
+import logging
+import multiprocessing
+import random
+import time
+
+import colony
+
+
+# Поля итога задания
+FIELDS = ("name", "seed", "age", "colonies", "population", "seconds",
+          "error")
+
+
+
+def load_space(source):
+    """
+    Creates the space of the job
+
+    source is the name of LCSF file or the function returning new space.
+
+    Returns new space
+    """
+    if callable(source):
+        return source()
+
+    with open(source) as f:
+        return colony.load_stream(f)
+
+
+
+def run_job(job):
+    """
+    Runs one job of the batch in the pool process
+
+    job is (name, source, seed, days, engine).
+
+    Returns the summary of the job as a dict with FIELDS keys
+    """
+    name, source, seed, days, engine = job
+    summary = dict.fromkeys(FIELDS, "")
+    summary["name"], summary["seed"] = name, seed
+    start = time.perf_counter()
+    try:
+        random.seed(seed)
+        space = load_space(source)
+        while len(space.colonies) > 0 and space.age < days:
+            colony.next_day(space, engine)
+    except Exception as e:
+        logging.error("Job [%s] with seed %d failed: %r", name, seed, e)
+        summary["error"] = repr(e)
+        summary["seconds"] = round(time.perf_counter() - start, 6)
+        return summary
+
+    live = [col for col in space.colonies if len(col.cells) > 0]
+    summary["age"] = space.age
+    summary["colonies"] = len(live)
+    summary["population"] = sum(sum(1 for age in col.row(y) if age > 0)
+                                for col in live for y in range(col.h))
+    summary["seconds"] = round(time.perf_counter() - start, 6)
+
+    return summary
+
+
+
+def run_batch(sources, days = 1000, engine = "python", seeds = (0,),
+              results = "results.csv", workers = None):
+    """
+    Runs the batch of spaces on the pool of processes
+
+    Every source (the name of LCSF file or the function returning new
+    space, which should be defined on the module level) is run with every
+    seed for given amount of days or while it has colonies.
+    Summaries are written into results CSV file in the order of jobs
+    completion.
+
+    Returns list of summaries
+    """
+    jobs = [(source if isinstance(source, str) else source.__name__,
+             source, seed, days, engine)
+            for source in sources for seed in seeds]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    logging.info("Batch of %d jobs started on %d processes.",
+                 len(jobs), workers)
+
+    summaries = []
+    start = time.perf_counter()
+    with open(results, "w", newline = "") as f, \
+         multiprocessing.Pool(workers) as pool:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        # Мелкие задания раздаются процессам пачками
+        chunk = max(1, len(jobs) // (workers * 16))
+        for summary in pool.imap_unordered(run_job, jobs, chunk):
+            writer.writerow(summary)
+            summaries.append(summary)
+    logging.info("Batch of %d jobs finished in %.3f seconds.",
+                 len(jobs), time.perf_counter() - start)
+
+    return summaries
+
+
+
+###############################################################################
+# Main function
+###############################################################################
+def main():
+    """
+    Programm entry point
+
+    Runs the batch of LCSF files given in the command line
+    """
+    parser = argparse.ArgumentParser(
+                description = "Runs many spaces on the pool of processes.")
+    parser.add_argument("files", nargs = "+", help = "LCSF files of spaces")
+    parser.add_argument("-d", "--days", type = int, default = 1000,
+                        help = "days limit for every space")
+    parser.add_argument("-e", "--engine", default = "python",
+                        choices = sorted(colony.ENGINES),
+                        help = "engine updating colonies")
+    parser.add_argument("-s", "--seeds", type = int, default = 1,
+                        help = "number of random seeds for every file")
+    parser.add_argument("-w", "--workers", type = int, default = None,
+                        help = "number of processes (all CPUs by default)")
+    parser.add_argument("-o", "--results", default = "results.csv",
+                        help = "CSV file for summaries")
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.WARNING,
+                        format = "%(asctime)s [%(levelname)s] : %(message)s")
+    start = time.perf_counter()
+    summaries = run_batch(args.files, args.days, args.engine,
+                          range(args.seeds), args.results, args.workers)
+    failed = sum(1 for summary in summaries if summary["error"])
+    print("%d spaces run in %.3f seconds (%d failed). Results are in %s." %
+          (len(summaries), time.perf_counter() - start, failed,
+           args.results))
+
+
+
+###############################################################################
+# Entry point
+###############################################################################
+if __name__ == "__main__":
+    main()
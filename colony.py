@@ -10,8 +10,15 @@
 # Пространство изменяется по дням.
 # По результатам каждого дня клетки могут возникать, умерать, либо оставаться
 # в прежнем, постарев на один день.
-# Данные Пространства представляются в виде списка колоний
-# space = [space_name, age, col1, col2, col3, ...]
+# Данные Пространства представляются объектом Space с именем, возрастом
+# и списком колоний
+# space.name, space.age, space.colonies = [col1, col2, col3, ...]
+#
+# Координаты колоний в пространстве не ограничены и могут быть
+# отрицательными. Пространство хранит начало отсчета origin_x, origin_y -
+# самый левый и самый верхний край, которого достигали колонии. При
+# отображении пространства начало отсчета вычитается из координат колоний,
+# поэтому колония, растущая влево или вверх, не сдвигает остальные колонии.
 #
 # Правила возникновения, смерти либо жизни клеток:
 #     - если у клетки более трех соседей, то она умирает от тесноты
@@ -35,36 +42,328 @@
 # |    |
 #  ----
 #
-# Данные о колонии представлены списком
-# [[age, x, y, w, h, colID], [row1, row2, row3, row4]]
+# Данные о колонии представлены объектом Colony с атрибутами
+# age, x, y, w, h, id и cells.
 # Если возвраст колонии больше 0, то добавлять новые строки клеток в
 # нее уже нельзя.
-# Каждая строчка представляется списком клеток
-# row = [cell1, cell2, cell3, cell4, ...]
+# Клетки колонии хранятся построчно в одном непрерывном массиве cells.
+# Колония является окном размером w * h над этим массивом, строки которого
+# имеют длину stride. Клетка со смещением (x, y) от левого верхнего угла
+# колонии находится в cells[off + y * stride + x]. Клетки массива за
+# пределами окна всегда пустые, поэтому при росте или сжатии колонии
+# достаточно сдвинуть окно.
 #
-# Клетка представляется возрастом клетки и списком соседних клеток в которых
-# живая клетка обозначается 1, а пустая 0. Соседями каждой клетки считаются
-# восемь клеток соприкасающимися с ней гранями и углами.
+# Клетка представляется своим возрастом. Если клетка пустая то ее возраст
+# равен 0. Соседями каждой клетки считаются восемь клеток соприкасающимися
+# с ней гранями и углами.
 #   8 1 2
 #   7 X 3
 #   6 5 4
-# Данные клетки представлены списком [age, [n1, n2, n3, ..., n8]]
-# Если клетка пустая то ее возраст равен 0
-# Номера соседних клеток начинаются с северного направления и далее по
-# часовой стрелке.
+# Соседи клетки не хранятся, а подсчитываются при каждом обновлении колонии.
+#
+# Следующее состояние колонии зависит только от ее положения и того, какие
+# клетки в ней живы. Поэтому если колония повторяет себя через p дней
+# (устойчивая фигура или осциллятор), она повторяет себя и дальше. Колония
+# помнит свои последние MAX_PERIOD состояний, а обнаружив повтор,
+# записывает p дней цикла и замораживается: далее ее состояние берется
+# из записи, а возраст клеток, живущих весь цикл, увеличивается на p за
+# каждый цикл. Колония размораживается при слиянии с соседней колонией.
+#
+# Одни и те же небольшие колонии (мигалки, блоки, планеры) встречаются
+# в разных пространствах и в разные дни. Движок memo запоминает следующее
+# состояние колонии по рисунку ее живых клеток в общем для всех пространств
+# процесса кэше PATTERNS. Окно колонии всегда имеет ровно одну пустую
+# рамку, поэтому одинаковые рисунки в разных местах дают одинаковый ключ.
+# Из кэша берется только рисунок и сдвиг колонии, а возраст клеток
+# рассчитывается заново, поэтому результат совпадает с update.
+#
+# В пространстве встречаются и мелкие колонии, и плотные средние, и большие
+# разреженные, поэтому движок auto выбирает движок для каждой колонии
+# заново каждый день по ее площади и плотности живых клеток (look
+# choose_engine). Движок, обновивший колонию, хранится в col.engine.
+#
+# Каждая колония хранит хэш своих живых клеток - сумму хэшей координат
+# живых клеток в пространстве. Движки frontier и counts обновляют его
+# по родившимся и умершим за день клеткам, после остальных движков он
+# пересчитывается. Хэш пространства складывается из хэшей его колоний.
+# Если пространство повторило свое состояние, дальше оно будет повторять
+# его с тем же периодом, поэтому run останавливается и сообщает период
+# и первый день цикла.
 
 # TODO: Add creating a space from a space_file
 
 
+import collections
 import random
+import re
 import sys
 import logging
-from functools import reduce
+import time
 import os.path
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 max_w = 1000
 max_h = 1000 
 
+# Наибольший период повтора колонии, который обнаруживается
+MAX_PERIOD = 15
+
+# Размер ячейки сетки индекса колоний пространства
+INDEX_CELL_SIZE = 32
+
+# Число рисунков колоний в кэше и наибольшая площадь запоминаемой колонии
+PATTERN_CACHE_SIZE = 4096
+PATTERN_MAX_AREA = 32 * 32
+
+# Наибольшая площадь мелкой колонии и наибольшая доля живых клеток
+# в разреженной колонии для движка auto
+AUTO_TINY_AREA = 16 * 16
+AUTO_SPARSE_DENSITY = 0.003
+
+# Множители хэша клетки (look cell_hash) и маска 64-битного хэша
+CELL_HASH_X = 0x9E3779B97F4A7C15
+CELL_HASH_Y = 0xC2B2AE3D27D4EB4F
+CELL_HASH_MIX = 0xBF58476D1CE4E5B9
+DIGEST_MASK = 0xFFFFFFFFFFFFFFFF
+
+###############################################################################
+# Space and Colony classes
+###############################################################################
+class Space:
+    """
+    Space of colonies
+
+    Keeps the name and the age of the space, the list of its colonies,
+    the index of the colonies places, the origin of the space, which
+    is subtracted from the colonies coordinates on displaying, and
+    the journal recording changes of the space (look journal.Journal).
+    """
+    __slots__ = ("name", "age", "colonies", "index", "origin_x", "origin_y",
+                 "journal")
+
+    def __init__(self, name):
+        self.name = name
+        self.age = 0
+        self.origin_x = 0
+        self.origin_y = 0
+        self.colonies = []
+        self.index = SpaceIndex()
+        self.journal = None
+
+
+
+class SpaceIndex:
+    """
+    Index of the colonies places
+
+    The space is divided into square cells of the uniform grid. Every
+    colony is registered in all grid cells its bounding box (including
+    its right and bottom edges) covers, so colonies which overlap or touch
+    each other always share at least one grid cell.
+    """
+    __slots__ = ("size", "cells", "boxes")
+
+    def __init__(self, size = INDEX_CELL_SIZE):
+        self.size = size
+        # Колонии в каждой ячейке сетки
+        self.cells = {}
+        # Границы, с которыми колония была внесена в индекс
+        self.boxes = {}
+
+    def keys(self, x, y, w, h):
+        """
+        Returns grid cells covered by the box
+        """
+        s = self.size
+        return [(gx, gy) for gx in range(x // s, (x + w) // s + 1)
+                         for gy in range(y // s, (y + h) // s + 1)]
+
+    def update(self, col):
+        """
+        Puts the colony into the index or moves it to its current place
+        """
+        box = (col.x, col.y, col.w, col.h)
+        if self.boxes.get(col) == box:
+            return
+        self.remove(col)
+        for key in self.keys(*box):
+            self.cells.setdefault(key, set()).add(col)
+        self.boxes[col] = box
+
+    def remove(self, col):
+        """
+        Removes the colony from the index
+        """
+        box = self.boxes.pop(col, None)
+        if box is None:
+            return
+        for key in self.keys(*box):
+            cell = self.cells[key]
+            cell.discard(col)
+            if len(cell) == 0:
+                del self.cells[key]
+
+    def retain(self, cols):
+        """
+        Removes from the index all colonies which are not in cols
+        """
+        cols = set(cols)
+        for col in [c for c in self.boxes if c not in cols]:
+            self.remove(col)
+
+    def query(self, col):
+        """
+        Returns colonies which could overlap or touch the colony
+        """
+        found = set()
+        for key in self.keys(col.x, col.y, col.w, col.h):
+            found.update(self.cells.get(key, ()))
+        found.discard(col)
+
+        return found
+
+
+
+class Colony:
+    """
+    Colony of cells
+
+    Keeps the header of the colony in attributes and the ages of its cells
+    row by row in the one contiguous array. The colony is a window of
+    w * h cells over this array, which rows are stride cells long. Cell
+    (0, 0) of the colony is at off position of the array.
+    """
+    __slots__ = ("age", "x", "y", "w", "h", "id", "cells", "stride", "off",
+                 "changed", "counts", "history", "cycle", "digest",
+                 "engine")
+
+    def __init__(self, x, y, col_id, age = 0):
+        self.age = age
+        self.x = x
+        self.y = y
+        self.w = 0
+        self.h = 0
+        self.id = col_id
+        self.cells = array("I")
+        self.stride = 0
+        self.off = 0
+        # Клетки, изменившиеся за последний день (look update_frontier)
+        self.changed = None
+        # Число живых соседей каждой клетки массива (look update_counts)
+        self.counts = None
+        # Хэши последних состояний колонии и цикл колонии
+        # (look track_cycle)
+        self.history = []
+        self.cycle = None
+        # Хэш живых клеток колонии (look col_digest)
+        self.digest = None
+        # Движок, обновивший колонию в последний раз
+        self.engine = None
+
+    def row(self, y):
+        """
+        Returns ages of the cells in y row of the colony
+        """
+        start = self.off + y * self.stride
+        return self.cells[start:start + self.w]
+
+    def set_cells(self, cells, w, h):
+        """
+        Sets cells of the colony from contiguous array of w * h cells
+        """
+        self.cells = cells
+        self.w, self.h = w, h
+        self.stride, self.off = w, 0
+
+
+
+class PatternCache:
+    """
+    Cache of the next states of the colonies patterns
+
+    Keeps at most size patterns. When the cache is full, the least
+    recently used pattern is evicted. Counts hits and misses of the
+    lookups.
+    """
+    __slots__ = ("size", "items", "hits", "misses")
+
+    def __init__(self, size = PATTERN_CACHE_SIZE):
+        self.size = size
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns cached value of the key or None if there is no such key
+        """
+        value = self.items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.items.move_to_end(key)
+
+        return value
+
+    def put(self, key, value):
+        """
+        Puts the value of the key into the cache
+        """
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.size:
+            self.items.popitem(last = False)
+
+    def clear(self):
+        """
+        Removes all the patterns and resets counters
+        """
+        self.items.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Returns (hits, misses, number of cached patterns)
+        """
+        return self.hits, self.misses, len(self.items)
+
+
+
+# Общий кэш рисунков колоний всех пространств процесса
+PATTERNS = PatternCache()
+
+
+
+# Таблицы перевода живых и пустых клеток в символы двоичной записи и обратно
+BITS_CHARS = bytes.maketrans(b"\x00\x01", b"01")
+CHARS_BITS = bytes.maketrans(b"01", b"\x00\x01")
+
+# Серия одинаковых клеток либо концов строк в маске RLE и серия одинаковых
+# символов в строке маски
+RLE_RUN = re.compile(r"(\d*)([bo$])")
+MASK_RUN = re.compile(r"0+|1+")
+
+# Наибольшая длина строки маски RLE при записи в файл
+RLE_LINE_LENGTH = 70
+
+
+
+def empty_cells(count):
+    """
+    Returns array of count empty cells
+    """
+    return array("I", [0]) * count
+
+
+
 ###############################################################################
 # Space functions
 ###############################################################################
@@ -72,7 +371,7 @@ def new_space(name):
     """
     Create new space
 
-    Retruns empty list of colonies of space.
+    Retruns space without colonies.
     """
     if name == "":
         logging.critical("Empty colony names aren't allowed.\n")
@@ -80,7 +379,7 @@ def new_space(name):
 
     logging.info("New space created with name [%s]", name)
 
-    return list([name, 0])
+    return Space(name)
 
 
 
@@ -161,6 +460,225 @@ def load_from_file(file):
 
 
 
+def parse_lcsf(file):
+    """
+    Parses LCSF file line by line
+
+    Generator yielding the name of the space first and then (x, y, rows)
+    of every colony of the space, where rows are the mask lines of
+    the colony. Missed coordinates are -1. Lines are parsed the same way
+    as load_from_file does. Nothing is yielded if the space is not defined.
+    Mask lines could also be written in RLE (look rle_rows). Consecutive
+    RLE lines of the colony make one RLE mask, which ends with "!" or with
+    the next literal mask line.
+    """
+    spc = False
+    header = None
+    col_lines = []
+    rle = []
+    for line in file:
+        line = line.strip()
+        if len(line) == 0 or line[0] == '#':
+            continue
+        line = line.split('#')[0]
+        # Строка маски колонии
+        if line.strip("01") == "":
+            if header is not None:
+                if len(rle) > 0:
+                    col_lines.extend(rle_rows("".join(rle)))
+                    rle = []
+                col_lines.append(line)
+        elif line.rstrip().strip("0123456789bo$!") == "":
+            if header is not None:
+                rle.append(line.rstrip())
+                if line.rstrip().endswith("!"):
+                    col_lines.extend(rle_rows("".join(rle)))
+                    rle = []
+        elif line.startswith("Space:"):
+            if spc:
+                continue
+            spc_params = line[len("Space:"):].split()
+            if len(spc_params) > 0:
+                spc = True
+                yield spc_params[0]
+        elif line.startswith("Colony:"):
+            if not spc:
+                logging.error("Space is not defined yet. " \
+                              "Could not add a colony.")
+                continue
+            if len(rle) > 0:
+                col_lines.extend(rle_rows("".join(rle)))
+                rle = []
+            if len(col_lines) > 0:
+                yield header + (col_lines,)
+                col_lines = []
+            col_params = line[len("Colony:"):].split(',')
+            x, y = -1, -1
+            if col_params[0].strip().isdecimal():
+                x = int(col_params[0])
+            if len(col_params) == 2 and col_params[1].strip().isdecimal():
+                y = int(col_params[1])
+            header = (x, y)
+
+    if len(rle) > 0:
+        col_lines.extend(rle_rows("".join(rle)))
+    if len(col_lines) > 0:
+        yield header + (col_lines,)
+
+
+
+def rle_rows(mask):
+    """
+    Decodes RLE mask of the colony
+
+    The mask is the standard Life RLE: "b" is an empty cell, "o" is a live
+    cell and "$" is the end of the row, every of them could be preceded by
+    the number of repeats. "!" ends the mask. For example "2bo$obo$3o!".
+
+    Returns list of the mask lines of the colony
+    """
+    rows = []
+    row = []
+    for count, tag in RLE_RUN.findall(mask.split("!")[0]):
+        count = int(count) if count else 1
+        if tag == "$":
+            rows.append("".join(row) or "0")
+            rows.extend(["0"] * (count - 1))
+            row = []
+        else:
+            row.append(("0" if tag == "b" else "1") * count)
+    if len(row) > 0:
+        rows.append("".join(row))
+
+    return rows
+
+
+
+def rle_mask(rows):
+    """
+    Encodes mask lines of the colony into RLE
+
+    Empty cells at the end of the rows and empty rows at the end of
+    the mask are omitted.
+
+    Returns RLE mask ended with "!"
+    """
+    mask = []
+    ends = 0
+    for row in rows:
+        row = row.rstrip("0")
+        if len(row) == 0:
+            ends += 1
+            continue
+        if len(mask) > 0:
+            mask.append(str(ends + 1) if ends > 0 else "")
+            mask.append("$")
+        elif ends > 0:
+            mask.append("%d$" % ends if ends > 1 else "$")
+        ends = 0
+        for run in MASK_RUN.findall(row):
+            mask.append(str(len(run)) if len(run) > 1 else "")
+            mask.append("b" if run[0] == "0" else "o")
+    mask.append("!")
+
+    return "".join(mask)
+
+
+def stream_colonies(colonies, space):
+    """
+    Adds colonies to the space one at a time
+
+    Generator taking (x, y, rows) of colonies parsed by parse_lcsf.
+    Every colony is built directly at the width of its widest mask line,
+    added to the space and yielded.
+    """
+    for x, y, rows in colonies:
+        if x == -1:
+            x = int(random.random()*max_w)
+        if y == -1:
+            y = int(random.random()*max_h)
+        col = Colony(x, y, len(space.colonies))
+        w = max(map(len, rows))
+        cells = empty_cells(0)
+        for row in rows:
+            cells.extend(row.encode().translate(CHARS_BITS))
+            if len(row) < w:
+                cells.extend(empty_cells(w - len(row)))
+        col.set_cells(cells, w, len(rows))
+        space.colonies.append(col)
+        logging.debug("Colony #%d [%d, %d] loaded to the space [%s].",
+                      col.id, w, len(rows), space.name)
+        yield col
+
+
+
+def load_stream(file):
+    """
+    Creates space from LCSF file streaming its colonies
+
+    Unlike load_from_file, every colony is built at once rather than
+    row by row. Parse throughput is logged.
+
+    Returns new space or None if the space is not defined in the file
+    """
+    start = time.perf_counter()
+    lines = parse_lcsf(file)
+    name = next(lines, None)
+    if name is None:
+        return None
+
+    space = new_space(name)
+    count, cells = 0, 0
+    for col in stream_colonies(lines, space):
+        count += 1
+        cells += col.w * col.h
+    seconds = max(time.perf_counter() - start, 1e-9)
+    logging.info("%d colonies of %d cells loaded in %.3f seconds " \
+                 "(%.0f colonies/s, %.0f cells/s).", count, cells, seconds,
+                 count / seconds, cells / seconds)
+
+    return space
+
+
+
+def save_to_file(space, file, rle = True):
+    """
+    Saves the space into LCSF file
+
+    Only live cells of the colonies are saved, so the ages of the cells
+    are lost. Coordinates in LCSF could not be negative, so the origin of
+    the space is subtracted from them. If rle is True, masks of
+    the colonies are written in RLE broken into lines of at most
+    RLE_LINE_LENGTH characters, otherwise every row is written as
+    the literal mask line.
+    """
+    file.write("Space: {}\n".format(space.name))
+    count = 0
+    for col in space.colonies:
+        rows = [bytes(map(bool, col.row(y))).translate(BITS_CHARS).decode()
+                for y in range(col.h)]
+        # Убрать пустые ряды и столбцы вокруг живых клеток
+        live = [y for y, row in enumerate(rows) if "1" in row]
+        if len(live) == 0:
+            continue
+        rows = rows[live[0]:live[-1] + 1]
+        minX = min(row.index("1") for row in rows if "1" in row)
+        rows = [row[minX:].rstrip("0") or "0" for row in rows]
+
+        file.write("\nColony: {}, {}\n".format(
+                   col.x + minX - space.origin_x,
+                   col.y + live[0] - space.origin_y))
+        if rle:
+            mask = rle_mask(rows)
+            for i in range(0, len(mask), RLE_LINE_LENGTH):
+                file.write(mask[i:i + RLE_LINE_LENGTH] + "\n")
+        else:
+            file.write("\n".join(rows) + "\n")
+        count += 1
+    logging.info("Space [%s] with %d colonies is saved.", space.name, count)
+
+
+
 def add_colony(space, col_mask = [], x = -1, y = -1):
     """
     Add an empty colony to the space
@@ -176,106 +694,293 @@ def add_colony(space, col_mask = [], x = -1, y = -1):
         x = int(random.random()*max_w)
     if y == -1:
         y = int(random.random()*max_h)
-    space.append([
-                  [0,
-                   x,
-                   y,
-                   0, 0, len(space) - 2
-                  ],
-                  []
-                 ])
-    logging.info("An empty colony added to the space [%s]", space[0])
+    space.colonies.append(Colony(x, y, len(space.colonies)))
+    logging.info("An empty colony added to the space [%s]", space.name)
 
     for r in col_mask:
-        load_row(space[len(space) - 1], r)
+        load_row(space.colonies[-1], r)
 
     return space
 
 
 
-def next_day(space):
+def next_day(space, engine = "python", pool = None):
     """
     Sets new day for the space
 
-    Updates all the colonies of the space.
+    Updates all the colonies of the space with given engine
+    (look ENGINES for available ones). If the pool of processes is given
+    (look parallel.new_pool), colonies are updated in it.
     Removes dead colonies from the space.
     Updates the age of the space.
+    Changes of the day are recorded into the journal of the space
+    if it has one.
     """
-    logging.debug("Changing day for space %s...", space[0])
-    # Проверить состояние колонии и убрать отмершие
-    for col in space[2:]:
-        if len(col[1]) == 0:
-            space.remove(col)
-            logging.info("Colony #%d deleted as dead from space %s.",
-                         col[0][5], space[0])
+    logging.debug("Changing day for space %s...", space.name)
+    remove_dead(space)
 
     # Перед первым днем проверить колонии на совпадения и 
     # раздвинуть их по необходимости
-    if space[1] == 0:
-        for col1 in space[2:]:
-            for col2 in space[2:]:
-                if col1 != col2:
-                    # ((x1 <= x2 and x1 + w1 >= x2) 
-                    #  or (x1 >= x2 and x1 <= x2 + w2))
-                    # and ((y1 <= y2 and y1 + h1 >= y2)
-                    #      or (y1 >= y2 and y1 <= y2 + h2))
-                    if (((col1[0][1] <= col2[0][1] 
-                        and col1[0][1] + col1[0][3] >= col2[0][1])
-                        or (col1[0][1] >= col2[0][1] 
-                            and col1[0][1] <= col2[0][1] + col2[0][3]))
-                        and ((col1[0][2] <= col2[0][2]
-                            and col1[0][2] + col1[0][4] >= col2[0][2])
-                            or (col1[0][2] >= col2[0][2]
-                                and col1[0][2] <= col2[0][2] + col2[0][4]))):
-                        # x2 = x2 + w1 + w2
-                        # y2 = y2 + h1 + h2
-                        logging.info("Colony #%d collides with colony #%d",
-                                    col1[0][5], col2[0][5])
-                        col2[0][1] += col1[0][3] + col2[0][3]
-                        col2[0][2] += col1[0][4] + col2[0][4]
-                        logging.info("New coordinates set for colony #%d [%d, %d]",
-                                     col2[0][5], col2[0][1], col2[0][2])
+    if space.age == 0:
+        separate_colonies(space)
+
+    if engine not in ENGINES:
+        logging.error("Unknown engine [%s]. Python engine will be used.",
+                      engine)
+        engine = "python"
 
     # Для каждой колонии в пространстве изменить состояние на один день
-    for col in space[2:]:
-        update(col)
+    update_colonies(space, engine, pool)
 
-    # расширить пространство, если колония имеет отрицательные координаты
-    for col in space[2:]:
-        if col[0][1] == -1:
-            for ccol in space[2:]:
-                if col != ccol:
-                    ccol[0][1] += 1
-            col[0][1] = 0         
-        if col[0][2] == -1:
-            for ccol in space[2:]:
-                if col != ccol:
-                    ccol[0][2] += 1
-            col[0][2] = 0         
+    # расширить пространство, если колонии вышли за его начало отсчета
+    update_origin(space)
         
     # Проверить колонии на соприкосновение и, по-необходимости,
     # обЪединить соседние
     check_intersection(space)
 
     # Изменить возраст пространства на один день
-    space[1] += 1
-    logging.info("For the space [%s] %d day is set.", space[0], space[1])
+    space.age += 1
+    logging.info("For the space [%s] %d day is set.", space.name, space.age)
+
+    if space.journal is not None:
+        space.journal.record(space)
+
+
+
+def update_colonies(space, engine = "python", pool = None):
+    """
+    Updates all the colonies of the space for one day
+
+    Frozen colonies replay their cycles, others are updated with given
+    engine (in the pool of processes if it is given and the engine is not
+    in LOCAL_ENGINES) and checked for cycles. Engine "auto" chooses
+    the engine for every colony (look choose_engine).
+    """
+    active = []
+    for col in space.colonies:
+        if col.cycle is not None and col.cycle[3] is not None:
+            replay_cycle(col)
+            col.engine = "cycle"
+        else:
+            active.append(col)
+
+    # Движок auto выбирает движок для каждой колонии
+    groups = {}
+    for col in active:
+        col.engine = choose_engine(col) if engine == "auto" else engine
+        groups.setdefault(col.engine, []).append(col)
+
+    for name, cols in groups.items():
+        if pool is not None and name not in LOCAL_ENGINES:
+            pool.update(cols, name)
+        else:
+            for col in cols:
+                ENGINES[name](col)
+            if name in DIGEST_ENGINES:
+                continue
+        # Хэш колонии будет пересчитан по ее клеткам
+        for col in cols:
+            col.digest = None
+
+    # Без возраста клеток цикл не может быть воспроизведен
+    if engine not in AGELESS_ENGINES:
+        for col in active:
+            track_cycle(col)
+
+
+
+def space_digest(space):
+    """
+    Returns the hash of the space state
+
+    The hash is the sum of the hashes of the space colonies, so it
+    depends only on places and live cells of the colonies.
+    """
+    return sum(col_digest(col) for col in space.colonies) & DIGEST_MASK
+
+
+
+def remove_dead(space):
+    """
+    Removes dead colonies from the space
+    """
+    # Проверить состояние колонии и убрать отмершие
+    for col in space.colonies[:]:
+        if len(col.cells) == 0:
+            space.colonies.remove(col)
+            space.index.remove(col)
+            if space.journal is not None:
+                space.journal.removed(col)
+            logging.info("Colony #%d deleted as dead from space %s.",
+                         col.id, space.name)
 
 
 
-def run(space, days = 1000):
+def separate_colonies(space):
+    """
+    Separates colliding colonies before the first day
+
+    Moves every colony colliding with an earlier colony of the space
+    away from it.
+    """
+    refresh_index(space)
+    pos = {col: i for i, col in enumerate(space.colonies)}
+    for col1 in space.colonies:
+        for col2 in sorted(space.index.query(col1), key = pos.get):
+            if col1 is not col2:
+                # ((x1 <= x2 and x1 + w1 >= x2)
+                #  or (x1 >= x2 and x1 <= x2 + w2))
+                # and ((y1 <= y2 and y1 + h1 >= y2)
+                #      or (y1 >= y2 and y1 <= y2 + h2))
+                if (((col1.x <= col2.x and col1.x + col1.w >= col2.x)
+                    or (col1.x >= col2.x and col1.x <= col2.x + col2.w))
+                    and ((col1.y <= col2.y
+                          and col1.y + col1.h >= col2.y)
+                        or (col1.y >= col2.y
+                            and col1.y <= col2.y + col2.h))):
+                    # x2 = x2 + w1 + w2
+                    # y2 = y2 + h1 + h2
+                    logging.info("Colony #%d collides with colony #%d",
+                                col1.id, col2.id)
+                    col2.x += col1.w + col2.w
+                    col2.y += col1.h + col2.h
+                    col2.digest = None
+                    space.index.update(col2)
+                    logging.info("New coordinates set for colony #%d [%d, %d]",
+                                 col2.id, col2.x, col2.y)
+
+
+
+def run(space, days = 1000, engine = "python", workers = 0, shards = 0,
+        checkpoint = 0, directory = "checkpoints", keep = 3):
     """
     Starts and runs the space
 
     Starts the space and manages its lifecycle for given amount of days
+    using given engine. If the space repeats its state, it is stopped
+    on the first repeated day.
+    If checkpoint is greater than 0, the snapshot of the space is saved
+    into the directory every checkpoint days and only keep newest
+    snapshots are left there (look snapshot.Checkpoints and resume).
+    If workers is greater than 1, colonies are updated in the pool of
+    given number of processes.
+    If shards is greater than 1, the space is split between given number
+    of processes (look shard.run) and only the final state of the space
+    is displayed.
+    Engine "hashlife" jumps over all the days at once and displays only
+    the final state of the space (look hashlife.advance). Its cells of
+    different colonies interact immediately rather than after merging
+    of the colonies, so its result differs from the other engines.
+
+    Returns (first day, period) of the cycle of the space or None if
+    the space did not repeat itself
     """
-    logging.info("Space %s started.", space[0])
-    while len(space) > 2 and days > 0 :
-        next_day(space)
+    logging.info("Space %s started with %s engine.", space.name, engine)
+    if engine == "hashlife":
+        import hashlife
+        logging.warning("HashLife calculates all the cells of the space " \
+                        "%s as one plane, so colonies interact before " \
+                        "merging and the result differs from other engines.",
+                        space.name)
+        hashlife.advance(space, days)
         display_space(space)
-        days -= 1
+        return
+    if shards > 1:
+        import shard
+        shard.run(space, days, engine, shards)
+        display_space(space)
+        return
 
-    logging.info("Space %s disapeared on %d day.", space[0], space[1])
+    pool = None
+    if workers > 1:
+        import parallel
+        pool = parallel.new_pool(workers)
+    points = None
+    if checkpoint > 0:
+        import snapshot
+        points = snapshot.Checkpoints(directory, checkpoint, keep)
+
+    # Дни, в которые встречались состояния пространства, по их хэшам
+    seen = {}
+    cycle = None
+    try:
+        while len(space.colonies) > 0 and days > 0 :
+            next_day(space, engine, pool)
+            display_space(space)
+            days -= 1
+            if points is not None:
+                points.check(space)
+
+            digest = space_digest(space)
+            if digest in seen:
+                cycle = (seen[digest], space.age - seen[digest])
+                print("Space {} repeats itself every {} days " \
+                      "from {} day.".format(space.name, cycle[1], cycle[0]))
+                logging.info("Space %s repeats itself every %d days " \
+                             "from %d day.", space.name, cycle[1], cycle[0])
+                break
+            seen[digest] = space.age
+    finally:
+        if pool is not None:
+            pool.close()
+        if points is not None:
+            points.close()
+
+    logging.info("Space %s disapeared on %d day.", space.name, space.age)
+    if engine == "memo" and pool is None:
+        logging.info("Patterns cache: %d hits, %d misses, %d patterns.",
+                     *PATTERNS.stats())
+
+    return cycle
+
+
+
+def resume(directory = "checkpoints", days = 1000, engine = "python",
+           workers = 0, checkpoint = 0, keep = 3, name = None):
+    """
+    Resumes the space from the newest valid snapshot in the directory
+
+    Only the snapshots of the space with given name are resumed, the newest
+    snapshot of any space if name is None (look snapshot.latest).
+    days is the day limit of the whole run, so the space runs till
+    the day days. Snapshots are saved further into the same directory
+    if checkpoint is greater than 0.
+
+    Returns (space, cycle), where cycle is the result of run, or
+    (None, None) if there is no valid snapshot
+    """
+    import snapshot
+    space = snapshot.latest(directory, name)
+    if space is None:
+        logging.error("There is no valid checkpoint in [%s].", directory)
+        return None, None
+
+    logging.info("Space %s resumed from %d day.", space.name, space.age)
+    cycle = run(space, days - space.age, engine, workers, 0, checkpoint,
+                directory, keep)
+
+    return space, cycle
+
+
+
+def update_origin(space):
+    """
+    Moves the origin of the space
+
+    Moves the origin of the space to the left and upper edges of
+    the colonies if they are out of it. Coordinates of the colonies
+    are not changed.
+    """
+    for col in space.colonies:
+        if col.x < space.origin_x:
+            space.origin_x = col.x
+            logging.info("Space [%s] origin moved to x = %d by colony #%d.",
+                         space.name, col.x, col.id)
+        if col.y < space.origin_y:
+            space.origin_y = col.y
+            logging.info("Space [%s] origin moved to y = %d by colony #%d.",
+                         space.name, col.y, col.id)
 
 
 
@@ -284,167 +989,207 @@ def check_intersection(space):
     Checks intersections of the colonies
 
     Checks intersections of the colonies and if so, unites them.
-    The older colony inherits all the cell of the younger one.
-    The younger one is disappeared from the space.
+    Touching colonies are gathered into groups first (with union-find over
+    pairs found by the space index), so chains of colonies are united at
+    once. The oldest colony of the group inherits all the cells of the
+    others, which disappear from the space.
     """
-    if len(space) - 2 <= 1:
+    if len(space.colonies) <= 1:
         return
 
-    for col1 in space[2:]:
-        for col2 in space[space.index(col1) + 1:]:
-            # isec определяет существование пересечения
-            # если isec == 1, пересечение было по вертикальной оси
-            # если isec == 2, пересечение было по горизонтальной оси
-            isec = 0
-            # Определить пересечение по вертикальной оси
-            # x1 + w1 == x2 or x1 == x2 + w2
-            if ((col1[0][0] >= 0 and col2[0][0] >= 0)
-                and ((col1[0][1] + col1[0][3] == col2[0][1])
-                or (col1[0][1] == col2[0][1] + col2[0][3]))):
-                # y1 >= y2 and y1 + h1 >= y2
-                if ((col1[0][2] >= col2[0][2]
-                     and col1[0][2] + col1[0][4] >= col2[0][2])
-                   # y1 <= y2 + h2 and y1 + h1 >= y2 + h2 
-                    or (col1[0][2] <= col2[0][2] + col2[0][4]
-                        and col1[0][2] + col1[0][4] >= col2[0][2] + col2[0][4])
-                   # y1 <= y2 and y1 + h1 <= y2 + h2
-                    or (col1[0][2] <= col2[0][2]
-                        and col1[0][2] + col1[0][4]
-                            <= col2[0][2] + col2[0][4])):
-                    logging.debug("Colony #%d and colony #%d intersect " \
-                                  "vertically", 
-                                   col1[0][5], col2[0][5])
-                    isec = 1
-
-            # Определить пересечение по горизонтальной оси       
-            # y1 == y2 + h2 or y1 + h1 == y2 
-            if (isec == 0
-                and (col1[0][2] == col2[0][2] + col2[0][4]
-                     or col1[0][2] + col1[0][4] == col2[0][2])):
-                # x1 <= x2 and x1 + w1 >= x2
-                if ((col1[0][1] <= col2[0][1]
-                     and col1[0][1] + col1[0][3] >= col2[0][1])
-                     # x1 <= x2 + w2 and x1 + w1 >= x2 + w2
-                     or (col1[0][1] <= col2[0][1] + col2[0][3]
-                         and col1[0][1] + col1[0][3] >= col2[0][1]
-                                                        + col2[0][3])
-                    # x1 >= x2 and x1 + w1 <= x2 + w2
-                     or (col1[0][1] >= col2[0][1]
-                         and col1[0][1] + col1[0][3]
-                             <= col2[0][1] + col2[0][3])):
-                    isec = 2
-                    logging.debug("Colony #%d and colony #%d intersect " \
-                                  "horizontally",
-                                  col1[0][5], col2[0][5])
-
-            # Если колонии соприкасаются по вертикальной оси
-            if isec == 1:
-                # Создать новую колонию, помещающую в себя обе объеденяемые
-                # колонии
-                ncol = list([
-                                [ # age = col1.age
-                                col1[0][0],
-                                # x = min(x1, x2)
-                                min(col1[0][1], col2[0][1]),
-                                # y = min(y1, y2)
-                                min(col1[0][2], col2[0][2]),
-                                # w = w1 + w2
-                                col1[0][3] + col2[0][3],
-                                # h = max(y1 + h1, y2 + h2) - min(y1, y2)
-                                max(col1[0][2] + col1[0][4],
-                                    col2[0][2] + col2[0][4])
-                                - min(col1[0][2], col2[0][2]),
-                                # colID = col1.colID
-                                col1[0][5]
-                                ],
-                            list()])
-
-                # Определить левую и правую колонии 
-                if col1[0][1] < col2[0][1]:
-                    coll = col1
-                    colr = col2
-                else:
-                    coll = col2
-                    colr = col1
-                # Для каждой строчки новой колонии из двух частей правой и
-                # левой сфомировать общую строку.
-                # Если првая или левая часть находится в текущей строке цикла,
-                # добавить ее как есть.
-                # Если там строки нет, то сформировать строку пустых клеток
-                # необходимой ширины. 
-                for y in range(ncol[0][4]):
-                    # Сформировать левую сторону строки новой колонии.
-                    if (ncol[0][2] + y >= coll[0][2] and
-                        ncol[0][2] + y <= coll[0][2] + coll[0][4] - 1):
-                        lpart = coll[1][ncol[0][2] + y - coll[0][2]]
-                    else:
-                        lpart = [[0, [0 for j in range(8)]] for i in range(coll[0][3])]
-                    
-                    # Сформировать правую сторону строки новой колонии.
-                    if (ncol[0][2] + y >= colr[0][2] and
-                        ncol[0][2] + y <= colr[0][2] + colr[0][4] - 1):
-                        rpart = colr[1][ncol[0][2] + y - colr[0][2]]
-                    else:
-                        rpart = [[0, [0 for j in range(8)]] for i in range(colr[0][3])]
-                    
-                    ncol[1].append(lpart + rpart)
-
-            # Если колонии соприкасаются по горизонтальной оси
-            if isec == 2:
-                # Создать новую колонию помещающую в себя обе объеденяемые
-                # колонии
-                ncol = list([ 
-                                [ # age = col1.age
-                                col1[0][0],
-                                # x = min(x1, x2)
-                                min(col1[0][1], col2[0][1]),
-                                # y = min(y1, y2)
-                                min(col1[0][2], col2[0][2]),
-                                # w = max(x1 + w1, x2 + w2) - min(x1, x2)
-                                max(col1[0][1] + col1[0][3], col2[0][1] + col2[0][3])
-                                - min(col1[0][1], col2[0][1]),                                    
-                                # h = h1 + h2
-                                col1[0][4] + col2[0][4],
-                                # colID = col1.colID
-                                col1[0][5]
-                                ],
-                            list()])
-
-                # Для всех записей новой колонии сделать следующее:
-                #  - проверить какой колонии принадлежит текущая строка
-                #  - взять всю строку из активной колонии 
-                #  - если строка начинается не с начала новой колонии, то
-                #    дополнить ее необходимым количеством пустых клеток
-                #    слева
-                #  - если ширина строки меньше чем ширина новой колонии,
-                #    то дополнить ее необходимым количеством пустых клеток
-                #    справа
-                for y in range(ncol[0][4]):
-                    if (ncol[0][2] + y >= col1[0][2] and
-                        ncol[0][2] + y <= col1[0][2] + col1[0][4]):
-                        colp = col1
-                    else:
-                        colp = col2
-
-                    nrow = colp[1][ncol[0][2] + y - colp[0][2]]
-                    for i in range(colp[0][1] - ncol[0][1]):
-                        nrow.insert(0, [0, [0 for j in range(8)]])
-                    nrow += [[0, [0 for j in range(8)]] 
-                                    for i in range(ncol[0][1]
-                                                    + ncol[0][3]
-                                                    - colp[0][1]
-                                                    + colp[0][3])]
-                    
-                    ncol[1].append(nrow)                        
-
-            if isec == 1 or isec == 2:
-                logging.info("New colony created instead of colony #%d and " \
-                             "colony#%d.", col1[0][5], col2[0][5])
-                space[space.index(col1)] = ncol
-                col2[0][0] = -1 # Пометить более молодую колонию на удаление
+    cols = space.colonies
+    for group in find_groups(space):
+        if len(group) > 1:
+            merge_group(space, [cols[i] for i in group])
 
     # Удалить все колонии, помеченные на удаление
-    space[2:] = list(filter(lambda c: c[0][0] >= 0, space[2:]))
+    space.colonies = [c for c in cols if c.age >= 0]
+
+
+
+def find_groups(space):
+    """
+    Finds groups of touching colonies
+
+    Pairs of touching colonies are found by the space index and united
+    into groups by union-find.
+
+    Returns list of groups, every group is the list of positions of its
+    colonies in the space
+    """
+    cols = space.colonies
+    refresh_index(space)
+    pos = {col: i for i, col in enumerate(cols)}
+    parent = list(range(len(cols)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, col1 in enumerate(cols):
+        # Отмершие колонии не проверяются
+        if len(col1.cells) == 0:
+            continue
+        for j in map(pos.get, space.index.query(col1)):
+            col2 = cols[j]
+            if j > i and len(col2.cells) > 0 and touch(col1, col2) != 0:
+                parent[find(j)] = find(i)
+
+    groups = {}
+    for i in range(len(cols)):
+        groups.setdefault(find(i), []).append(i)
+
+    return list(groups.values())
+
+
+
+def merge_group(space, members):
+    """
+    Merges the group of touching colonies of the space
+
+    The oldest colony of the group (the one with the least number if
+    there are several of them) stays in the space and inherits all
+    the cells of the others. The others are marked to be removed from
+    the space by the age -1.
+
+    Returns the colony stayed in the space
+    """
+    # Старшая колония группы (при равном возрасте - первая из них)
+    # остается в пространстве на своем месте
+    keep = min(members, key = lambda col: (-col.age, col.id))
+    for col in members:
+        space.index.remove(col)
+    ncol = merge_colonies(members, keep)
+    logging.info("Colony #%d absorbed colonies %s.", ncol.id,
+                 ", ".join("#%d" % col.id for col in members
+                           if col is not ncol))
+    for col in members:
+        if col is not ncol:
+            col.age = -1 # Пометить поглощенную колонию на удаление
+    space.index.update(ncol)
+    if space.journal is not None:
+        space.journal.merged(ncol, members)
+
+    return ncol
+
+
+
+def touch(col1, col2):
+    """
+    Checks if two colonies touch each other
+
+    Returns 1 if colonies touch by vertical side, 2 if they touch by
+    horizontal side and 0 if they do not touch.
+    """
+    # Определить пересечение по вертикальной оси
+    # (x1 + w1 == x2 or x1 == x2 + w2)
+    # and y1 <= y2 + h2 and y1 + h1 >= y2
+    if ((col1.x + col1.w == col2.x or col1.x == col2.x + col2.w)
+        and col1.y <= col2.y + col2.h and col1.y + col1.h >= col2.y):
+        logging.debug("Colony #%d and colony #%d intersect vertically",
+                      col1.id, col2.id)
+        return 1
+
+    # Определить пересечение по горизонтальной оси
+    # (y1 == y2 + h2 or y1 + h1 == y2)
+    # and x1 <= x2 + w2 and x1 + w1 >= x2
+    if ((col1.y == col2.y + col2.h or col1.y + col1.h == col2.y)
+        and col1.x <= col2.x + col2.w and col1.x + col1.w >= col2.x):
+        logging.debug("Colony #%d and colony #%d intersect horizontally",
+                      col1.id, col2.id)
+        return 2
+
+    return 0
+
+
+
+def merge_colonies(members, keep):
+    """
+    Merges the group of touching colonies
+
+    The oldest colony keep takes place of the bounding box of all
+    the members. Its cells stay in its buffer, which is reallocated only
+    if the bounding box does not fit into it. Every row of every other
+    member is block-copied into it once.
+
+    Returns keep colony
+    """
+    x = min(col.x for col in members)
+    y = min(col.y for col in members)
+    move_window(keep, x - keep.x, y - keep.y,
+                max(col.x + col.w for col in members) - x,
+                max(col.y + col.h for col in members) - y)
+    keep.x, keep.y = x, y
+    keep.changed = None
+    keep.counts = None
+    # Соседи изменили колонию, поэтому ее цикл прерван
+    keep.history = []
+    keep.cycle = None
+    keep.digest = None
+
+    for col in members:
+        if col is keep:
+            continue
+        copy_window(keep.cells, keep.off + (col.y - keep.y) * keep.stride
+                    + col.x - keep.x, keep.stride,
+                    col.cells, col.off, col.stride, col.w, col.h)
+
+    return keep
+
+
+
+def copy_window(dst, dst_start, dst_stride, src, src_start, src_stride,
+                w, h):
+    """
+    Copies the window of w * h cells into the other array of cells
+
+    The window starts at src_start of src array, which rows are
+    src_stride cells long, and is copied to dst_start of dst array with
+    rows of dst_stride cells. Live cells of dst are not overwritten by
+    empty cells of the window.
+    """
+    for y in range(h):
+        start = dst_start + y * dst_stride
+        row = src[src_start + y * src_stride:src_start + y * src_stride + w]
+        # Окна колоний могут перекрываться пустыми рамками, поэтому
+        # уже перенесенные живые клетки не затираются
+        if any(dst[start:start + w]):
+            for x, age in enumerate(row):
+                if age > dst[start + x]:
+                    dst[start + x] = age
+        else:
+            dst[start:start + w] = row
+
+
+
+def age_cells(cells):
+    """
+    Makes all live cells one day older
+
+    The array is changed in place if NumPy is installed.
+
+    Returns the array of cells
+    """
+    if np is not None:
+        ages = np.frombuffer(cells, dtype = np.uintc)
+        ages += ages > 0
+        return cells
+
+    return array("I", (age + 1 if age else 0 for age in cells))
+
+
+
+def refresh_index(space):
+    """
+    Brings the space index in line with the colonies of the space
+
+    Only colonies moved or resized since the last refresh are re-indexed.
+    """
+    space.index.retain(space.colonies)
+    for col in space.colonies:
+        space.index.update(col)
 
 
                     
@@ -454,10 +1199,20 @@ def display_space(space):
 
     Displays detailed information about space and every colony in the space
     """
-    print("Space [", space[0], "] of age [", space[1], "] consists of ",
-          len(list(space))-2, " colonies.\n",
+    print("Space [", space.name, "] of age [", space.age, "] consists of ",
+          len(space.colonies), " colonies.\n",
+          "Origin of the space is at [", space.origin_x, space.origin_y,
+          "]\n",
           "----------------------------------------------------------------")
-    for i, col in enumerate(space[2:]):
+    engines = {}
+    for col in space.colonies:
+        if col.engine is not None:
+            engines[col.engine] = engines.get(col.engine, 0) + 1
+    if len(engines) > 0:
+        print("Colonies are updated by engines:",
+              ", ".join("{} {}".format(name, count)
+                        for name, count in sorted(engines.items())))
+    for i, col in enumerate(space.colonies):
         display_colony(col, i + 1)
 
 ###############################################################################
@@ -467,106 +1222,582 @@ def update(col):
     """
     Updates colony
 
-    Updates cells of the colony on every step
+    Updates cells of the colony on every step. Edges of the live cells are
+    found on the same pass, so the colony is not scanned once more
+    to re-centre it.
     """
-    logging.debug("Start updating colony #%s...", col[0][5])
-    if col[0][0] == 0:
+    logging.debug("Start updating colony #%s...", col.id)
+    if col.age == 0:
         col_init(col)
 
-    logging.debug("Checking neighbourhood for every cell...")
-    # Обновить информацию по соседям для каждой клетки
-    for y, row in enumerate(col[1]):
-        for x, c in enumerate(row):
-            # Проверить северное направление.
-            if y == 0:
-                c[1][0] = 0
-            elif col[1][y - 1][x][0] != 0:
-                c[1][0] = 1
-            else:
-                c[1][0] = 0
-            # Проверить северо-восторчное направление.
-            if y == 0 or x == col[0][3] - 1:
-                c[1][1] = 0
-            elif col[1][y - 1][x + 1][0] != 0:
-                c[1][1] = 1
-            else:
-                c[1][1] = 0
-            # Проверить восточное направление.
-            if x == col[0][3] - 1:
-                c[1][2] = 0
-            elif col[1][y][x + 1][0] != 0:
-                c[1][2] = 1
-            else:
-                c[1][2] = 0
-            # Проверить юго-восточное направление.
-            if x == col[0][3] - 1 or y == col[0][4] - 1:
-                c[1][3] = 0
-            elif col[1][y + 1][x + 1][0] != 0:
-                c[1][3] = 1
-            else:
-                c[1][3] = 0
-            # Проверить южное направление.
-            if y == col[0][4] - 1:
-                c[1][4] = 0
-            elif col[1][y + 1][x][0] != 0:
-                c[1][4] = 1
-            else:
-                c[1][4] = 0
-            # Проверить юго-западное направление.
-            if y == col[0][4] - 1 or x == 0:
-                c[1][5] = 0
-            elif col[1][y + 1][x - 1][0] != 0:
-                c[1][5] = 1
-            else:
-                c[1][5] = 0
-            # Проверить западное направление.
-            if x == 0:
-                c[1][6] = 0
-            elif col[1][y][x - 1][0] != 0:
-                c[1][6] = 1
-            else:
-                c[1][6] = 0
-            # Проверить северо-западное направление.
-            if y == 0 or x == 0:
-                c[1][7] = 0
-            elif col[1][y - 1][x - 1][0] != 0:
-                c[1][7] = 1
+    logging.debug("Updating cells...")
+    w, h, stride, off, cells = col.w, col.h, col.stride, col.off, col.cells
+    # Новые клетки располагаются в буфере той же формы, что и старые
+    ncells = empty_cells(len(cells))
+    minX, maxX, minY, maxY = w, -1, h, -1
+    for y in range(h):
+        for x in range(w):
+            nCnt = count_neighbours(col, x, y)
+            # Определить новый статус клетки
+            idx = off + y * stride + x
+            age = cells[idx]
+            if age == 0 and nCnt == 3:
+                ncells[idx] = 1
+            elif age > 0 and nCnt >= 2 and nCnt <= 3:
+                ncells[idx] = age + 1
             else:
-                c[1][7] = 0
+                continue
+            if minX > x:
+                minX = x
+            if maxX < x:
+                maxX = x
+            if minY > y:
+                minY = y
+            maxY = y
+    col.cells = ncells
+
+    if maxX < 0:
+        col_clear(col)
+    else:
+        recentre(col, minX, maxX, minY, maxY)
+
+        logging.debug("Setting new coordinates for the colony")
+        # Определить новые координаты колонии
+        col.x += minX - 1
+        col.y += minY - 1
+    col.age += 1
+    logging.info("Colony #%d has dimension [%d, %d, %d, %d].", 
+                 col.id, col.x, col.y, col.w, col.h)
+
+
+
+def count_neighbours(col, x, y):
+    """
+    Counts live neighbours of the cell
+
+    Counts live neighbours of the cell (x, y) of the colony
+    without going out of the colony borders.
+    """
+    cells, stride, off = col.cells, col.stride, col.off
+    nCnt = 0
+    for ny in range(max(y - 1, 0), min(y + 2, col.h)):
+        for nx in range(max(x - 1, 0), min(x + 2, col.w)):
+            if (nx != x or ny != y) and cells[off + ny * stride + nx] != 0:
+                nCnt += 1
+
+    return nCnt
+    
+
+
+def update_np(col):
+    """
+    Updates colony with NumPy
+
+    Vectorized version of update. Ages of the colony cells are viewed
+    as 2-D NumPy array, neighbours are counted by sum of eight shifted
+    copies of the array and births, deaths and ageing are applied by masks.
+
+    Result is identical to update.
+    """
+    if np is None:
+        logging.error("NumPy is not installed. Python engine will be used.")
+        update(col)
+        return
+
+    logging.debug("Start updating colony #%s with NumPy...", col.id)
+    if col.age == 0:
+        col_init(col)
+
+    if col.h == 0:
+        ages = np.zeros((0, 0), dtype = np.uintc)
+    else:
+        ages = np.frombuffer(col.cells, dtype = np.uintc)
+        ages = ages.reshape(-1, col.stride)
+        ages = ages[col.off // col.stride:col.off // col.stride + col.h,
+                    col.off % col.stride:col.off % col.stride + col.w]
+
+    # Подсчитать соседей каждой клетки как сумму восьми сдвигов колонии.
+    # Пустая рамка вокруг колонии заменяет проверку границ.
+    live = np.pad(ages > 0, 1).astype(np.int8)
+    h, w = ages.shape
+    nCnt = (live[:h, :w] + live[:h, 1:w + 1] + live[:h, 2:]
+            + live[1:h + 1, :w] + live[1:h + 1, 2:]
+            + live[2:, :w] + live[2:, 1:w + 1] + live[2:, 2:])
 
     logging.debug("Updating cells...")
-    # Определить новый статус каждой клетки
-    for y, row in enumerate(col[1]):
-        for x, c in enumerate(row):
-            nCnt = reduce(lambda x, y: x + y, c[1])
-            if c[0] == 0 and nCnt == 3:
-                c[0] = 1
-            elif c[0] > 0:
-                if nCnt > 3:
-                    c[0] = 0
-                elif nCnt < 2:
-                    c[0] = 0
-                else:
-                    c[0] += 1
+    # Живая клетка с двумя или тремя соседями стареет на один день,
+    # остальные живые клетки умирают. В пустой клетке с тремя соседями
+    # возникает жизнь.
+    alive = ages > 0
+    ages = np.where(alive & ((nCnt == 2) | (nCnt == 3)), ages + 1, 0)
+    ages[~alive & (nCnt == 3)] = 1
+
+    rows = np.flatnonzero(ages.any(axis = 1))
+    cols = np.flatnonzero(ages.any(axis = 0))
+    if len(rows) == 0:
+        col_clear(col)
+        col.age += 1
+        return
 
-    minX, minY = col_init(col)
+    minY, maxY = rows[0], rows[-1]
+    minX, maxX = cols[0], cols[-1]
+    ages = np.pad(ages[minY:maxY + 1, minX:maxX + 1], 1)
+    col.set_cells(array("I", ages.astype(np.uintc).tobytes()),
+                  ages.shape[1], ages.shape[0])
 
     logging.debug("Setting new coordinates for the colony")
-    # Определить новые координаты и возраст колонии
-    if minX == 0:
-        col[0][1] -= 1
-    if minY == 0:
-        col[0][2] -= 1
-    if minX > 1:
-        col[0][1] += minX - 1
-    if minY > 1:
-        col[0][2] += minY - 1
-    col[0][0] += 1
+    col.x += int(minX) - 1
+    col.y += int(minY) - 1
+    col.age += 1
     logging.info("Colony #%d has dimension [%d, %d, %d, %d].", 
-                 col[0][5], col[0][1], col[0][2], col[0][3], col[0][4])
+                 col.id, col.x, col.y, col.w, col.h)
     
 
 
+def row_bits(row):
+    """
+    Packs row of the cells ages into integer bitboard
+
+    Bit x of the result is set if the cell x of the row is alive.
+    """
+    if len(row) == 0:
+        return 0
+
+    return int(bytes(map(bool, reversed(row))).translate(BITS_CHARS), 2)
+
+
+
+def bits_step(rows, w):
+    """
+    Calculates next generation of the bitboard
+
+    Every row of the colony is packed into one integer. Neighbours
+    of all cells of the row are summed at once by bitwise full adders
+    into three bits of the counter (count of 8 neighbours overflows to 0,
+    which is dead as well).
+
+    Returns list of rows of the next generation
+    """
+    mask = (1 << w) - 1
+    nrows = []
+    for y, b in enumerate(rows):
+        a = rows[y - 1] if y > 0 else 0
+        c = rows[y + 1] if y < len(rows) - 1 else 0
+        s0, s1, s2 = 0, 0, 0
+        for v in ((a << 1) & mask, a, a >> 1,
+                  (b << 1) & mask, b >> 1,
+                  (c << 1) & mask, c, c >> 1):
+            c0 = s0 & v
+            s0 ^= v
+            c1 = s1 & c0
+            s1 ^= c0
+            s2 ^= c1
+        # Клетка жива, если у нее три соседа либо два соседа и
+        # она была жива
+        nrows.append(s1 & ~s2 & (s0 | b))
+
+    return nrows
+
+
+
+def update_bits(col, ages = True):
+    """
+    Updates colony with bitboard
+
+    Liveness of the colony cells is packed row by row into integers and
+    the next generation is calculated by bitwise logic over whole rows.
+    If ages is True, ages of the cells are the same as update gives,
+    otherwise every live cell gets age 1, which saves visiting
+    every live cell for throughput runs.
+    """
+    logging.debug("Start updating colony #%s with bitboard...", col.id)
+    if col.age == 0:
+        col_init(col)
+
+    rows = [row_bits(col.row(y)) for y in range(col.h)]
+    set_bits(col, bits_next(rows, col.w), ages)
+
+
+
+def bits_next(rows, w):
+    """
+    Calculates next state of the colony bitboard
+
+    Returns (minX, minY, nrows) where nrows are rows of the next
+    generation from minY to the last live row, and minX and minY are
+    edges of its live cells in the current colony, or None if there are no
+    live cells
+    """
+    nrows = bits_step(rows, w)
+
+    live = [y for y, r in enumerate(nrows) if r != 0]
+    if len(live) == 0:
+        return None
+
+    minY, maxY = live[0], live[-1]
+    minX = min((nrows[y] & -nrows[y]).bit_length() - 1 for y in live)
+
+    return minX, minY, tuple(nrows[minY:maxY + 1])
+
+
+
+def set_bits(col, state, ages = True):
+    """
+    Sets next state of the colony calculated by bits_next
+
+    If ages is True, ages of the cells are the same as update gives,
+    otherwise every live cell gets age 1.
+    """
+    if state is None:
+        col_clear(col)
+        col.age += 1
+        return
+
+    # Сформировать колонию с пустой рамкой вокруг живых клеток
+    minX, minY, nrows = state
+    maxX = max(r.bit_length() - 1 for r in nrows)
+    nw = maxX - minX + 1 + 2
+    cells = empty_cells(nw)
+    for y, r in enumerate(nrows, minY):
+        if ages:
+            row = empty_cells(nw)
+            start = col.off + y * col.stride
+            # Возраст каждой живой клетки на один день больше, чем был
+            # (у родившейся клетки он был 0)
+            while r:
+                x = (r & -r).bit_length() - 1
+                row[x - minX + 1] = col.cells[start + x] + 1
+                r &= r - 1
+            cells.extend(row)
+        else:
+            cells.extend(format((r >> minX) << 1, "0%db" % nw)[::-1]
+                         .encode().translate(CHARS_BITS))
+    cells.extend(empty_cells(nw))
+
+    col.set_cells(cells, nw, len(nrows) + 2)
+
+    logging.debug("Setting new coordinates for the colony")
+    col.x += minX - 1
+    col.y += minY - 1
+    col.age += 1
+    logging.info("Colony #%d has dimension [%d, %d, %d, %d].",
+                 col.id, col.x, col.y, col.w, col.h)
+
+
+
+def update_bits_noage(col):
+    """
+    Updates colony with bitboard without tracking cells ages
+    """
+    update_bits(col, False)
+
+
+
+def update_memo(col, cache = None):
+    """
+    Updates colony with the cache of patterns
+
+    The key of the pattern is the width of the colony and its rows packed
+    into bitboards. The next state of the pattern (look bits_next) is
+    taken from the cache (PATTERNS if it is not given) or calculated
+    and put into it. Ages of the cells are set as update gives.
+    Colonies larger than PATTERN_MAX_AREA rarely repeat, so they are
+    not cached.
+    """
+    logging.debug("Start updating colony #%s with patterns cache...", col.id)
+    if col.age == 0:
+        col_init(col)
+    if cache is None:
+        cache = PATTERNS
+
+    rows = tuple(row_bits(col.row(y)) for y in range(col.h))
+    if col.w * col.h > PATTERN_MAX_AREA:
+        set_bits(col, bits_next(rows, col.w))
+        return
+
+    key = (col.w, rows)
+    state = cache.get(key)
+    if state is None:
+        state = bits_next(rows, col.w)
+        # Гибель колонии запоминается пустым кортежем
+        cache.put(key, state or ())
+    set_bits(col, state or None)
+
+
+
+def choose_engine(col):
+    """
+    Chooses the engine for the colony by its area and density
+
+    Tiny colonies are updated by bitboard, which is the fastest plain
+    Python engine for them. Colonies with a few live cells over a large
+    area are updated by counts, whose cost depends on the number of changed
+    cells only. Other colonies are updated by numpy or by bitboard if numpy
+    is not available.
+    The colony updated by counts keeps it until its density is twice as
+    large as AUTO_SPARSE_DENSITY, so counts are not recounted every time
+    the density crosses the limit.
+
+    Returns the name of the engine
+    """
+    area = col.w * col.h
+    if area <= AUTO_TINY_AREA:
+        return "bitboard"
+
+    # Клетки массива за пределами окна пустые
+    density = (len(col.cells) - col.cells.count(0)) / area
+    limit = AUTO_SPARSE_DENSITY
+    if col.engine == "counts":
+        limit *= 2
+    if density < limit:
+        return "counts"
+
+    return "numpy" if np is not None else "bitboard"
+
+
+
+def update_auto(col):
+    """
+    Updates colony with the engine chosen by choose_engine
+    """
+    col.engine = choose_engine(col)
+    ENGINES[col.engine](col)
+
+
+
+def update_frontier(col):
+    """
+    Updates colony by its active frontier
+
+    Only cells changed on the previous day and their neighbours could
+    change their state, so only they are evaluated. Changed cells are kept
+    in col.changed as (x, y) pairs together with the age of the colony
+    they were found at.
+    If there is no such information for the current age of the colony
+    (new or merged colony, or the colony was updated by other engine),
+    all the cells are evaluated.
+    Borders of the colony are checked only on the sides where cells
+    were born or died.
+
+    Result is identical to update.
+    """
+    logging.debug("Start updating colony #%s by frontier...", col.id)
+    if col.age == 0:
+        col_init(col)
+    # Колония без живых клеток остается пустой
+    if col.h == 0:
+        col.age += 1
+        return
+
+    w, h, stride, off = col.w, col.h, col.stride, col.off
+    if col.changed is None or col.changed[0] != col.age:
+        active = [(x, y) for y in range(h) for x in range(w)]
+    else:
+        active = set()
+        for x, y in col.changed[1]:
+            for ny in range(max(y - 1, 0), min(y + 2, h)):
+                for nx in range(max(x - 1, 0), min(x + 2, w)):
+                    active.add((nx, ny))
+    logging.debug("%d of %d cells are active.", len(active), w * h)
+
+    births, deaths = [], []
+    for x, y in active:
+        nCnt = count_neighbours(col, x, y)
+        if col.cells[off + y * stride + x] == 0:
+            if nCnt == 3:
+                births.append((x, y))
+        elif nCnt < 2 or nCnt > 3:
+            deaths.append((x, y))
+
+    # Все живые клетки стареют на один день, затем применяются
+    # рождения и смерти
+    col.cells = age_cells(col.cells)
+    cells = col.cells
+    for x, y in births:
+        cells[off + y * stride + x] = 1
+    for x, y in deaths:
+        cells[off + y * stride + x] = 0
+    update_digest(col, births, deaths)
+
+    edges = frontier_edges(col, births, deaths)
+    if edges is None:
+        col_clear(col)
+        col.age += 1
+        return
+    minX, maxX, minY, maxY = edges
+
+    recentre(col, minX, maxX, minY, maxY)
+    # Изменившиеся клетки, оказавшиеся за пределами новой колонии,
+    # остаются в списке, поскольку их соседи внутри колонии должны
+    # быть проверены
+    changed = [(x - minX + 1, y - minY + 1) for x, y in births + deaths]
+
+    logging.debug("Setting new coordinates for the colony")
+    col.x += minX - 1
+    col.y += minY - 1
+    col.age += 1
+    col.changed = (col.age, changed)
+    logging.info("Colony #%d has dimension [%d, %d, %d, %d].",
+                 col.id, col.x, col.y, col.w, col.h)
+
+
+
+def frontier_edges(col, births, deaths):
+    """
+    Finds edges of live cells of the updated colony
+
+    births and deaths are (x, y) of the cells born and died in the colony.
+    Before the update live cells filled the colony without its empty
+    border. So edges could be extended only by births in the border and
+    narrowed only by deaths at the edge.
+
+    Returns minX, maxX, minY and maxY of live cells or None if there are
+    no live cells
+    """
+    w, h, stride, off, cells = col.w, col.h, col.stride, col.off, col.cells
+    if w == 0:
+        return None
+    bx = {x for x, y in births}
+    by = {y for x, y in births}
+    dx = {x for x, y in deaths}
+    dy = {y for x, y in deaths}
+    is_col = lambda x: any(cells[off + y * stride + x] for y in range(h))
+    is_row = lambda y: any(col.row(y))
+    minX = frontier_edge(0 in bx, 1 in dx, range(1, w), is_col)
+    if minX < 0:
+        return None
+    maxX = w - 1 - frontier_edge(w - 1 in bx, w - 2 in dx,
+                                  range(w - 2, minX - 1, -1), is_col)
+    minY = frontier_edge(0 in by, 1 in dy, range(1, h), is_row)
+    maxY = h - 1 - frontier_edge(h - 1 in by, h - 2 in dy,
+                                  range(h - 2, minY - 1, -1), is_row)
+
+    return minX, maxX, minY, maxY
+
+
+
+def frontier_edge(born, died, lines, is_live):
+    """
+    Finds the edge of live cells from one side of the colony
+
+    born  - cells were born in the empty border line
+    died  - cells died in the first live line
+    lines - lines from the first live one inwards the colony
+    is_live - checks if the line has live cells
+
+    Returns the number of the first line with live cells counted from
+    the border or -1 if there are no live lines
+    """
+    if born:
+        return 0
+    # Если на краю никто не умер, граница остается на месте
+    if not died:
+        return 1
+    for i, line in enumerate(lines):
+        if is_live(line):
+            return i + 1
+
+    return -1
+
+
+
+def update_counts(col):
+    """
+    Updates colony by neighbour counts
+
+    The count of live neighbours of every cell of the colony buffer is
+    kept in col.counts. When a cell is born or dies, only the counts of its
+    eight neighbours are changed, and only the cells with changed counts
+    are evaluated on the next day. So the update costs as much as the
+    number of changed cells rather than the colony area (besides getting
+    older of live cells).
+    Counts are kept together with the age of the colony they are valid
+    for. If they are not valid (new or merged colony, the colony was
+    updated by other engine or its buffer was reallocated), they are
+    counted again and all the cells of the colony are evaluated.
+
+    Result is identical to update.
+    """
+    logging.debug("Start updating colony #%s by neighbour counts...", col.id)
+    if col.age == 0:
+        col_init(col)
+    # Колония без живых клеток остается пустой
+    if col.h == 0:
+        col.counts = None
+        col.age += 1
+        return
+
+    w, h, stride, off = col.w, col.h, col.stride, col.off
+    # Смещения восьми соседей клетки в массиве
+    around = (-stride - 1, -stride, -stride + 1, -1, 1,
+              stride - 1, stride, stride + 1)
+    if col.counts is None or col.counts[0] != col.age:
+        counts = bytearray(len(col.cells))
+        for y in range(h):
+            start = off + y * stride
+            for i in range(start, start + w):
+                if col.cells[i] > 0:
+                    for d in around:
+                        counts[i + d] += 1
+        active = [off + y * stride + x for y in range(h) for x in range(w)]
+    else:
+        counts, active = col.counts[1], col.counts[2]
+    logging.debug("%d of %d cells are active.", len(active), w * h)
+
+    # Клетки за пределами колонии не имеют живых соседей
+    # и не изменяются
+    births, deaths = [], []
+    for i in active:
+        if col.cells[i] == 0:
+            if counts[i] == 3:
+                births.append(i)
+        elif counts[i] < 2 or counts[i] > 3:
+            deaths.append(i)
+
+    col.cells = age_cells(col.cells)
+    cells = col.cells
+    for i in births:
+        cells[i] = 1
+    for i in deaths:
+        cells[i] = 0
+
+    born = [((i - off) % stride, (i - off) // stride) for i in births]
+    died = [((i - off) % stride, (i - off) // stride) for i in deaths]
+    update_digest(col, born, died)
+    edges = frontier_edges(col, born, died)
+    if edges is None:
+        col_clear(col)
+        col.counts = None
+        col.age += 1
+        return
+    minX, maxX, minY, maxY = edges
+
+    recentre(col, minX, maxX, minY, maxY)
+    logging.debug("Setting new coordinates for the colony")
+    col.x += minX - 1
+    col.y += minY - 1
+    col.age += 1
+
+    if col.cells is not cells:
+        # Массив клеток перемещен, поэтому счетчики будут
+        # подсчитаны заново
+        col.counts = None
+    else:
+        changed = set()
+        for i in births:
+            for d in around:
+                counts[i + d] += 1
+                changed.add(i + d)
+        for i in deaths:
+            for d in around:
+                counts[i + d] -= 1
+                changed.add(i + d)
+        col.counts = (col.age, counts, changed)
+    logging.info("Colony #%d has dimension [%d, %d, %d, %d].",
+                 col.id, col.x, col.y, col.w, col.h)
+
+
+
 def col_init(col):
     """
     Initializes the colony
@@ -576,62 +1807,293 @@ def col_init(col):
 
     Returns minX and minY of the colony before adding empty borders
     """        
-    logging.debug("Start formatting colony #%d...", col[0][5])
-    minX, maxX, minY, maxY = col[0][3], 0, col[0][4], 0
-    for y, row in enumerate(col[1]):
-        for x, cell in enumerate(row):
-            if cell[0] != 0:
-                if maxX < x:
-                    maxX = x
+    logging.debug("Start formatting colony #%d...", col.id)
+    minX, maxX, minY, maxY = col.w, -1, col.h, -1
+    for y in range(col.h):
+        row = col.row(y)
+        if not any(row):
+            continue
+        if minY > y:
+            minY = y
+        maxY = y
+        for x, age in enumerate(row):
+            if age != 0:
                 if minX > x:
                     minX = x
-                if maxY < y:
-                    maxY = y
-                if minY > y:
-                    minY = y
+                break
+        for x in range(col.w - 1, maxX, -1):
+            if row[x] != 0:
+                maxX = x
+                break
     logging.debug( "minX, maxX, minY, max: [%d, %d, %d, %d]",
                   minX, maxX, minY, maxY)
 
-    if minX > maxX:
-        logging.info("There are no live cells in the colony #%d. " \
-                     "Will be cleared.", col[0][5])                         
-        col[1] = []
-        col[0][1] = 0
-        col[0][2] = 0
+    if maxX < 0:
+        col_clear(col)
         return -1, -1
 
-    logging.debug("Remove %d leading empty rows.", minY)
-    for row in range(minY):
-        col[1].pop(0)
+    recentre(col, minX, maxX, minY, maxY)
+    # Клетки сдвинуты относительно места колонии
+    col.digest = None
+    logging.info("Size of the colony #%d after initialization is [%d, %d].",
+                 col.id, col.w, col.h)
 
-    logging.debug("Remove %d trailing empty rows.", col[0][4] - maxY - 1)
-    for row in range(col[0][4] - maxY - 1):
-        col[1].pop()
+    return minX, minY
 
-    col[0][4] = maxY - minY + 1
-    logging.debug("Real heigth of the colony is %d.", col[0][4])
 
-    for i, row in enumerate(col[1]):
-        for c in range(minX):
-            row.pop(0)
-        for c in range(col[0][3] - maxX - 1):
-            row.pop()
 
-    col[0][3] = maxX - minX + 1
-    logging.debug("Real width of the colony is %d.", col[0][3])
+def recentre(col, minX, maxX, minY, maxY):
+    """
+    Re-centres the colony over its live cells
 
-    col[1].insert(0, [[0, [0 for i in range(8)]] for i in range(col[0][3])])
-    col[1].append([[0, [0 for i in range(8)]] for i in range(col[0][3])])
-    col[0][4] += 2
+    minX, maxX, minY and maxY are edges of live cells in the current
+    colony. The colony is moved to keep exactly one empty line around them.
+    """
+    move_window(col, minX - 1, minY - 1, maxX - minX + 1 + 2,
+                maxY - minY + 1 + 2)
 
-    for row in col[1]:
-        row.insert(0, [0, [0 for i in range(8)]])
-        row.append([0, [0 for i in range(8)]])
-    col[0][3] += 2
-    logging.info("Size of the colony #%d after initialization is [%d, %d].",
-                 col[0][5], col[0][3], col[0][4])
 
-    return minX, minY
+
+def move_window(col, dx, dy, w, h):
+    """
+    Moves the window of the colony over its cells buffer
+
+    The new window of w * h cells starts at (dx, dy) of the current
+    colony. All the buffer cells out of the window are empty, so the window
+    is just moved if it fits into the buffer. Otherwise cells of the current
+    window are block-copied row by row into the new buffer with free space
+    around the window for the following days. Live cells should not be
+    out of the new window.
+    Coordinates of the colony are not changed.
+    """
+    if col.stride > 0:
+        bx = col.off % col.stride + dx
+        by = col.off // col.stride + dy
+        if (bx >= 0 and by >= 0 and bx + w <= col.stride
+            and (by + h) * col.stride <= len(col.cells)):
+            col.off = by * col.stride + bx
+            col.w, col.h = w, h
+            return
+
+    pad = max(w, h) // 4 + 1
+    stride = w + 2 * pad
+    cells = empty_cells(stride * (h + 2 * pad))
+    # Скопировать общую часть старого и нового окна
+    minX, maxX = max(dx, 0), min(dx + w, col.w)
+    for y in range(max(dy, 0), min(dy + h, col.h)):
+        start = col.off + y * col.stride
+        nstart = (pad + y - dy) * stride + pad - dx
+        cells[nstart + minX:nstart + maxX] = col.cells[start + minX:
+                                                       start + maxX]
+    col.cells, col.stride, col.off = cells, stride, pad * stride + pad
+    col.w, col.h = w, h
+    logging.debug("Cells buffer of the colony #%d is reallocated to [%d, %d].",
+                  col.id, stride, h + 2 * pad)
+
+
+
+def track_cycle(col):
+    """
+    Checks if the updated colony repeats itself
+
+    The colony remembers hashes of its state (look col_digest) for
+    the last MAX_PERIOD days. If the hash was already met p days ago,
+    the colony probably repeats itself with period p, so its full state is
+    recorded for p days (look col.cycle). If after that the colony has
+    the same place and live cells as on the first recorded day, it repeats
+    itself forever and is frozen.
+    """
+    if len(col.cells) == 0:
+        return
+
+    if col.cycle is not None:
+        period, start, states, perm, digests = col.cycle
+        if len(states) < period:
+            states.append((col.x, col.y, col.w, col.h, copy_cells(col)))
+            return
+        # Совпадение хэшей проверяется сравнением живых клеток
+        x, y, w, h, cells = states[0]
+        if col_state(col) == (x, y, w, h,
+                              tuple(row_bits(cells[r * w:(r + 1) * w])
+                                    for r in range(h))):
+            freeze(col)
+            return
+        logging.info("Colony #%d does not repeat itself.", col.id)
+        col.cycle = None
+
+    digest = col_digest(col)
+    for period in range(1, len(col.history) + 1):
+        if col.history[-period] == digest:
+            logging.info("Colony #%d repeats itself with period %d " \
+                         "on %d day.", col.id, period, col.age)
+            col.history = []
+            col.cycle = (period, col.age,
+                         [(col.x, col.y, col.w, col.h, copy_cells(col))],
+                         None, None)
+            return
+
+    col.history.append(digest)
+    if len(col.history) > MAX_PERIOD:
+        del col.history[0]
+
+
+
+def col_state(col):
+    """
+    Returns the state of the colony
+
+    The state is (x, y, w, h, rows), where rows are the rows of the colony
+    packed into bitboards.
+    """
+    return (col.x, col.y, col.w, col.h,
+            tuple(row_bits(col.row(y)) for y in range(col.h)))
+
+
+
+def col_digest(col):
+    """
+    Returns the hash of the colony state
+
+    The hash is the sum of the hashes of live cells of the colony
+    (look cell_hash), so it depends on the place of the colony and its
+    live cells, but not on their ages. It is calculated only if it is not
+    known since the last change of the colony. The colony without live
+    cells has 0 hash.
+    """
+    if col.digest is None:
+        if len(col.cells) == 0:
+            col.digest = 0
+        else:
+            # Клетки массива за пределами окна пустые
+            col.digest = cells_digest(col.x - col.off % col.stride,
+                                      col.y - col.off // col.stride,
+                                      col.stride, col.cells)
+
+    return col.digest
+
+
+
+def cell_hash(x, y):
+    """
+    Returns 64-bit hash of the cell of the space at x, y
+    """
+    z = (x * CELL_HASH_X + y * CELL_HASH_Y) & DIGEST_MASK
+    z = ((z ^ (z >> 31)) * CELL_HASH_MIX) & DIGEST_MASK
+
+    return z ^ (z >> 29)
+
+
+
+def cells_digest(x, y, w, cells):
+    """
+    Returns the sum of the hashes of live cells
+
+    cells are rows of w cells starting at x, y of the space.
+    """
+    if np is not None:
+        live = np.flatnonzero(np.frombuffer(cells, dtype = np.uintc))
+        # Арифметика uint64 NumPy идет по модулю 2^64, как в cell_hash
+        z = ((live % w + x).astype(np.uint64) * np.uint64(CELL_HASH_X)
+             + (live // w + y).astype(np.uint64) * np.uint64(CELL_HASH_Y))
+        z = (z ^ (z >> np.uint64(31))) * np.uint64(CELL_HASH_MIX)
+        z ^= z >> np.uint64(29)
+        return int(z.sum(dtype = np.uint64))
+
+    return sum(cell_hash(x + i % w, y + i // w)
+               for i, age in enumerate(cells) if age > 0) & DIGEST_MASK
+
+
+
+def update_digest(col, births, deaths):
+    """
+    Updates the hash of the colony by born and died cells
+
+    births and deaths are (x, y) of the cells in the colony, which is not
+    moved yet. Unknown hash is left to be calculated by col_digest.
+    """
+    if col.digest is None:
+        return
+
+    digest = col.digest
+    for x, y in births:
+        digest += cell_hash(col.x + x, col.y + y)
+    for x, y in deaths:
+        digest -= cell_hash(col.x + x, col.y + y)
+    col.digest = digest & DIGEST_MASK
+
+
+
+def copy_cells(col):
+    """
+    Returns contiguous copy of cells of the colony window
+    """
+    if col.stride == col.w:
+        return col.cells[col.off:col.off + col.w * col.h]
+
+    cells = empty_cells(0)
+    for y in range(col.h):
+        cells.extend(col.row(y))
+
+    return cells
+
+
+
+def freeze(col):
+    """
+    Freezes the colony with recorded cycle
+
+    Finds cells living on every day of the cycle. Every cycle their age
+    grows by the period, while ages of other cells repeat. Place of
+    the colony could change during the cycle, so these cells are kept
+    for every day of the cycle.
+    """
+    period, start, states, perm, digests = col.cycle
+    live = None
+    for x, y, w, h, cells in states:
+        alive = {(x + i % w, y + i // w) for i, age in enumerate(cells)
+                 if age > 0}
+        live = alive if live is None else live & alive
+    perm = [sorted((cy - y) * w + cx - x for cx, cy in live)
+            for x, y, w, h, cells in states]
+    digests = [cells_digest(x, y, w, cells) for x, y, w, h, cells in states]
+    col.cycle = (period, start, states, perm, digests)
+    col.changed = None
+    logging.info("Colony #%d is frozen with period %d.", col.id, period)
+
+
+
+def replay_cycle(col):
+    """
+    Sets the next day of the frozen colony from its cycle
+    """
+    period, start, states, perm, digests = col.cycle
+    col.age += 1
+    days = col.age - start
+    x, y, w, h, cells = states[days % period]
+    perm = perm[days % period]
+    col.digest = digests[days % period]
+    cells = cells[:]
+    grow = days // period * period
+    if np is not None and len(perm) > 0:
+        ages = np.frombuffer(cells, dtype = np.uintc)
+        ages[perm] += grow
+    else:
+        for i in perm:
+            cells[i] += grow
+    col.set_cells(cells, w, h)
+    col.x, col.y = x, y
+
+
+
+def col_clear(col):
+    """
+    Clears the colony without live cells
+    """
+    logging.info("There are no live cells in the colony #%d. " \
+                 "Will be cleared.", col.id)
+    col.set_cells(array("I"), 0, 0)
+    col.x, col.y = 0, 0
+    col.changed = None
 
 
 
@@ -646,7 +2108,7 @@ def load_row(colony, new_row):
 
     For example "000100100"
     """
-    if colony[0][0] > 0:
+    if colony.age > 0:
         logging.error("Colony already changed. Adding new rows is prohibited.")
         return
     if len(new_row) == 0:
@@ -659,41 +2121,36 @@ def load_row(colony, new_row):
     
     # Если длина новой строки больше чем текущая ширина колонии, дополнить все
     # существующие строки колонии до новой длины пустыми клетками.
-    if len(new_row) > colony[0][3]:
-        for row in colony[1]:
-            for i in range(len(new_row) - colony[0][3]):
-                row.append(list([0, [0 for j in range(8)]]))
+    if len(new_row) > colony.w:
+        cells = array("I")
+        for y in range(colony.h):
+            cells.extend(colony.row(y))
+            cells.extend(empty_cells(len(new_row) - colony.w))
+        colony.cells = cells
         logging.debug("Colony #%d width was expanded from %d to %d.", 
-                      colony[0][5], 
-                      colony[0][3],
+                      colony.id,
+                      colony.w,
                       len(new_row))
-        colony[0][3] = len(new_row)
+        colony.w = len(new_row)
+        colony.stride = colony.w
 
-    # Создать новую строку, соответсвущую new_row
-    nrow = list()
-    for pos in new_row:
-        if pos == "0":
-            age = 0
-        else:
-            age = 1
-        nrow.append(list([age, [0 for j in range(8)]]))
+    # Добавить в колонию новую строку, соответсвущую new_row
+    colony.cells.extend(0 if pos == "0" else 1 for pos in new_row)
     logging.debug("New row was created from [%s] for colony #%d", new_row,
-                  colony[0][5])
+                  colony.id)
 
     # По необходимости дополнить новую строку пустыми клетками до текущей
     # ширины колонии
-    if len(new_row) < colony[0][3]:
-        for i in range(colony[0][3] - len(new_row)):
-            nrow.append(list([0, [0 for j in range(8)]]))
+    if len(new_row) < colony.w:
+        colony.cells.extend(empty_cells(colony.w - len(new_row)))
         logging.debug(
             "Newly created row [%s] was expanded to %d length for colony #%d", 
-            new_row, colony[0][3], colony[0][5])
+            new_row, colony.w, colony.id)
 
-    # Добавить новую строку в колонию
-    colony[1].append(nrow)
     logging.info("Newly created row [%s] was added to the colony #%d at %d", 
-                 new_row, colony[0][5], colony[0][4])
-    colony[0][4] += 1
+                 new_row, colony.id, colony.h)
+    colony.h += 1
+    colony.stride = colony.w
 
 
 
@@ -703,18 +2160,20 @@ def display_colony(colony, pos):
 
     Dislplays detailed information about the colony
     """
-    print("Colony #", pos, "is", colony[0][0],
-          "days old and takes place at[", colony[0][1], colony[0][2], "]")
-    print("  colony height is", colony[0][4],
-          "colony width is", colony[0][3])
+    print("Colony #", pos, "is", colony.age,
+          "days old and takes place at[", colony.x, colony.y, "]")
+    print("  colony height is", colony.h,
+          "colony width is", colony.w)
+    if colony.engine is not None:
+        print("  colony is updated by", colony.engine, "engine")
     print("====== Colony map ========")
-    for row in colony[1]:
+    for y in range(colony.h):
         sr = ""
-        for cell in row:
-            if cell[0] == 0:
+        for age in colony.row(y):
+            if age == 0:
                 sr += ' '
-            elif cell[0] < 10:
-                sr += str(cell[0])
+            elif age < 10:
+                sr += str(age)
             else:
                 sr += '0'
         print(sr)
@@ -722,6 +2181,30 @@ def display_colony(colony, pos):
 
 
 
+# Движки, которыми может обновляться колония за один день
+ENGINES = {
+    "python": update,
+    "numpy": update_np,
+    "bitboard": update_bits,
+    "bitboard_noage": update_bits_noage,
+    "frontier": update_frontier,
+    "memo": update_memo,
+    "counts": update_counts,
+    "auto": update_auto,
+}
+
+# Движки, не сохраняющие возраст клеток
+AGELESS_ENGINES = {"bitboard_noage"}
+
+# Движки, обновляющие хэш колонии по родившимся и умершим клеткам
+DIGEST_ENGINES = {"frontier", "counts"}
+
+# Движки, хранящие между днями состояние колонии, которое не передается
+# в пул процессов, поэтому они всегда работают в основном процессе
+LOCAL_ENGINES = {"counts"}
+
+
+
 ###############################################################################
 # Main function
 ###############################################################################
@@ -739,7 +2222,7 @@ def main():
     
     if os.path.isfile("lifecells.lcsf"):
         with open("lifecells.lcsf") as f:
-            space = load_from_file(f)
+            space = load_stream(f)
     else:
         space = new_space("Universe")
 
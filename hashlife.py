@@ -0,0 +1,340 @@
+# hashlife.py
+#
+# EnesGUL12, dr-dobermann, 2018.
+#
+# https://github.com/EnesGUL12/LifeCells.git
+#
+# Движок HashLife для пространства из библиотеки colony.py
+#
+# Все живые клетки пространства помещаются в одно квадродерево.
+# Узел дерева уровня k описывает квадрат клеток со стороной 2^k и состоит из
+# четырех узлов уровня k - 1:
+#   a b
+#   c d
+# Узлы с одинаковым содержимым хранятся в единственном экземпляре, поэтому
+# результат расчета будущего состояния узла запоминается в самом узле и
+# повторно не считается. Узел уровня k за один шаг расчета перемещается
+# в будущее на 2^(k - 2) дней, что позволяет пропускать дни степенями двойки.
+#
+# Возраст клеток в HashLife не хранится. После расчета все живые клетки
+# получают возраст 1, а пространство заново разбивается на колонии.
+# Клетки разных колоний рассчитываются как клетки одной плоскости, поэтому
+# они влияют друг на друга сразу, а не только после слияния колоний.
+
+import logging
+
+import colony
+
+
+class Node:
+    """
+    Node of the quadtree
+
+    Keeps level of the node, four quadrants of the node, number of live
+    cells in it and calculated future states of the node.
+    """
+    __slots__ = ("k", "a", "b", "c", "d", "n", "next")
+
+    def __init__(self, k, a, b, c, d, n):
+        self.k = k
+        self.a = a
+        self.b = b
+        self.c = c
+        self.d = d
+        self.n = n
+        self.next = {}
+
+
+
+# Листья дерева: живая и пустая клетка
+ON = Node(0, None, None, None, None, 1)
+OFF = Node(0, None, None, None, None, 0)
+
+# Все созданные узлы дерева по их квадрантам. Узлы хранятся только
+# во время расчета пространства (look advance).
+NODES = {}
+
+# Пустые узлы по уровням
+ZEROS = [OFF]
+
+
+
+def join(a, b, c, d):
+    """
+    Returns the node made from four quadrants
+    """
+    key = (a, b, c, d)
+    node = NODES.get(key)
+    if node is None:
+        node = Node(a.k + 1, a, b, c, d, a.n + b.n + c.n + d.n)
+        NODES[key] = node
+
+    return node
+
+
+
+def get_zero(k):
+    """
+    Returns empty node of level k
+    """
+    while len(ZEROS) <= k:
+        z = ZEROS[-1]
+        ZEROS.append(join(z, z, z, z))
+
+    return ZEROS[k]
+
+
+
+def centre(m):
+    """
+    Returns the node of the next level with m in its centre
+    """
+    z = get_zero(m.k - 1)
+
+    return join(join(z, z, z, m.a), join(z, z, m.b, z),
+                join(z, m.c, z, z), join(m.d, z, z, z))
+
+
+
+def is_padded(m):
+    """
+    Checks if all live cells of m are in the central half of it
+    """
+    return (m.a.n == m.a.d.d.n and m.b.n == m.b.c.c.n
+            and m.c.n == m.c.b.b.n and m.d.n == m.d.a.a.n)
+
+
+
+def life(a, b, c, d, e, f, g, h, i):
+    """
+    Returns the state of the cell e with neighbours a, b, c, d, f, g, h, i
+    """
+    nCnt = a.n + b.n + c.n + d.n + f.n + g.n + h.n + i.n
+    if nCnt == 3 or (e.n and nCnt == 2):
+        return ON
+
+    return OFF
+
+
+
+def life_4x4(m):
+    """
+    Returns central 2x2 node of 4x4 node m after one day
+    """
+    return join(
+        life(m.a.a, m.a.b, m.b.a, m.a.c, m.a.d, m.b.c, m.c.a, m.c.b, m.d.a),
+        life(m.a.b, m.b.a, m.b.b, m.a.d, m.b.c, m.b.d, m.c.b, m.d.a, m.d.b),
+        life(m.a.c, m.a.d, m.b.c, m.c.a, m.c.b, m.d.a, m.c.c, m.c.d, m.d.c),
+        life(m.a.d, m.b.c, m.b.d, m.c.b, m.d.a, m.d.b, m.c.d, m.d.c, m.d.d))
+
+
+
+def successor(m, j):
+    """
+    Calculates future of the node
+
+    Returns central node of m of level m.k - 1 after 2^j days.
+    j should not be greater than m.k - 2.
+    """
+    s = m.next.get(j)
+    if s is not None:
+        return s
+
+    if m.n == 0:
+        s = m.a
+    elif m.k == 2:
+        s = life_4x4(m)
+    else:
+        # Девять пересекающихся узлов уровня k - 1 покрывают узел m.
+        # Их центры рассчитываются в будущее на 2^j дней, если j меньше
+        # максимально возможного, либо на половину этого срока с последующим
+        # расчетом еще на половину.
+        c1 = successor(join(m.a.a, m.a.b, m.a.c, m.a.d), j)
+        c2 = successor(join(m.a.b, m.b.a, m.a.d, m.b.c), j)
+        c3 = successor(join(m.b.a, m.b.b, m.b.c, m.b.d), j)
+        c4 = successor(join(m.a.c, m.a.d, m.c.a, m.c.b), j)
+        c5 = successor(join(m.a.d, m.b.c, m.c.b, m.d.a), j)
+        c6 = successor(join(m.b.c, m.b.d, m.d.a, m.d.b), j)
+        c7 = successor(join(m.c.a, m.c.b, m.c.c, m.c.d), j)
+        c8 = successor(join(m.c.b, m.d.a, m.c.d, m.d.c), j)
+        c9 = successor(join(m.d.a, m.d.b, m.d.c, m.d.d), j)
+        if j < m.k - 2:
+            s = join(join(c1.d, c2.c, c4.b, c5.a),
+                     join(c2.d, c3.c, c5.b, c6.a),
+                     join(c4.d, c5.c, c7.b, c8.a),
+                     join(c5.d, c6.c, c8.b, c9.a))
+        else:
+            s = join(successor(join(c1, c2, c4, c5), j),
+                     successor(join(c2, c3, c5, c6), j),
+                     successor(join(c4, c5, c7, c8), j),
+                     successor(join(c5, c6, c8, c9), j))
+
+    m.next[j] = s
+
+    return s
+
+
+
+def construct(cells):
+    """
+    Constructs the quadtree from the live cells
+
+    cells is a set of (x, y) coordinates of live cells.
+
+    Returns the root node and coordinates of its left upper corner
+    """
+    minX = min(x for x, y in cells)
+    minY = min(y for x, y in cells)
+    level = {(x - minX, y - minY): ON for x, y in cells}
+    k = 0
+    while len(level) > 1 or k < 3:
+        z = get_zero(k)
+        nlevel = {}
+        while len(level) > 0:
+            x, y = next(iter(level))
+            x, y = x - (x & 1), y - (y & 1)
+            nlevel[x >> 1, y >> 1] = join(level.pop((x, y), z),
+                                          level.pop((x + 1, y), z),
+                                          level.pop((x, y + 1), z),
+                                          level.pop((x + 1, y + 1), z))
+        level = nlevel
+        k += 1
+
+    return level.popitem()[1], minX, minY
+
+
+
+def expand(node, x, y, cells):
+    """
+    Adds coordinates of all live cells of the node to cells set
+    """
+    if node.n == 0:
+        return
+    if node.k == 0:
+        cells.add((x, y))
+        return
+
+    size = 1 << (node.k - 1)
+    expand(node.a, x, y, cells)
+    expand(node.b, x + size, y, cells)
+    expand(node.c, x, y + size, cells)
+    expand(node.d, x + size, y + size, cells)
+
+
+
+def advance_node(node, x, y, days):
+    """
+    Moves the node into the future on given amount of days
+
+    Days are decomposed into powers of two and every power is made
+    by one successor step.
+
+    Returns new node and coordinates of its left upper corner
+    """
+    j = 0
+    while days > 0:
+        if days & 1:
+            # Узел должен быть достаточного уровня и иметь пустые поля,
+            # чтобы клетки не вышли за его пределы за 2^j дней
+            while node.k < j + 2 or node.k < 3 or not is_padded(node):
+                x -= 1 << (node.k - 1)
+                y -= 1 << (node.k - 1)
+                node = centre(node)
+            node = successor(centre(node), j)
+        days >>= 1
+        j += 1
+
+    return node, x, y
+
+
+
+def split_colonies(cells, age):
+    """
+    Splits live cells into colonies
+
+    Cells which empty borders would touch each other are placed into
+    the same colony. Every live cell gets age 1.
+
+    Returns list of colonies
+    """
+    cols = []
+    cells = set(cells)
+    while len(cells) > 0:
+        group = [cells.pop()]
+        i = 0
+        while i < len(group):
+            x, y = group[i]
+            for ny in range(y - 2, y + 3):
+                for nx in range(x - 2, x + 3):
+                    if (nx, ny) in cells:
+                        cells.remove((nx, ny))
+                        group.append((nx, ny))
+            i += 1
+
+        minX = min(x for x, y in group)
+        minY = min(y for x, y in group)
+        col = colony.Colony(minX - 1, minY - 1, len(cols), age)
+        w = max(x for x, y in group) - minX + 1 + 2
+        h = max(y for x, y in group) - minY + 1 + 2
+        col.set_cells(colony.empty_cells(w * h), w, h)
+        for x, y in group:
+            col.cells[(y - col.y) * col.w + x - col.x] = 1
+        cols.append(col)
+
+    return cols
+
+
+
+def advance(space, days):
+    """
+    Moves the space into the future
+
+    Calculates the state of the space after given amount of days with
+    HashLife and replaces colonies of the space by new ones made from
+    live cells. Ages of the cells are not kept.
+    New colonies are prepared as next_day does before collecting their
+    cells. Nodes of the tree are dropped after the calculation.
+
+    Returns the space
+    """
+    colony.remove_dead(space)
+    if space.age == 0:
+        colony.separate_colonies(space)
+    # Новые колонии получают пустую рамку, как перед первым днем
+    # в next_day
+    for col in space.colonies:
+        if col.age == 0:
+            colony.col_init(col)
+
+    cells = set()
+    for col in space.colonies:
+        for y in range(col.h):
+            for x, age in enumerate(col.row(y)):
+                if age > 0:
+                    cells.add((col.x + x, col.y + y))
+
+    space.age += days
+    if len(cells) == 0:
+        space.colonies = []
+        logging.info("Space [%s] has no live cells.", space.name)
+        return space
+
+    node, x, y = construct(cells)
+    node, x, y = advance_node(node, x, y, days)
+    cells = set()
+    expand(node, x, y, cells)
+    # Узлы дерева не нужны следующему вызову, а их число растет с каждым
+    # рассчитанным днем
+    NODES.clear()
+    del ZEROS[1:]
+    space.colonies = split_colonies(cells, space.age)
+
+    # Колонии остаются на своих местах, даже если вышли за начало
+    # отсчета пространства, сдвигается только оно
+    colony.update_origin(space)
+
+    logging.info("Space [%s] advanced by HashLife on %d days to %d day. " \
+                 "It has %d colonies.", space.name, days, space.age,
+                 len(space.colonies))
+
+    return space
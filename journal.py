@@ -0,0 +1,364 @@
+# journal.py
+#
+# EnesGUL12, dr-dobermann, 2018.
+#
+# https://github.com/EnesGUL12/LifeCells.git
+#
+# Журнал изменений пространства из библиотеки colony.py
+#
+# Полный снимок пространства (look snapshot.py) слишком велик, чтобы
+# сохранять его каждый день. Журнал записывает только изменения каждого
+# дня, а полный снимок (ключевой кадр) - раз в несколько дней, поэтому
+# состояние пространства в любой день восстанавливается от ближайшего
+# предшествующего ключевого кадра.
+#
+# Журнал подключается к пространству (space.journal), и next_day сообщает
+# ему об удаленных и слитых колониях и о завершении дня. За день все живые
+# клетки стареют на один день, поэтому для каждой колонии записываются
+# только клетки, возраст которых отличается от ожидаемого: родившиеся,
+# умершие и клетки, которые сдвинулись или перешли в другую колонию.
+# Ожидаемый возраст клеток колонии получается из окон этой колонии
+# и поглощенных ею колоний за прошлый день (look expected_cells), и окно
+# колонии сравнивается с ним целиком.
+# Кроме клеток записываются начало отсчета пространства, удаленные
+# колонии, слияния колоний и заголовки колоний (возраст, место и размер).
+#
+# Журнал только дописывается. Файл начинается с сигнатуры, за которой
+# следуют кадры: заголовок (вид кадра, день пространства и длина данных)
+# и данные, сжатые zlib. Данные ключевого кадра - снимок пространства,
+# данные кадра дня - последовательность 8-байтовых целых:
+#   origin_x origin_y
+#   n id1 ... idn                       - удаленные колонии
+#   n (keep m id1 ... idm) * n          - слияния колоний
+#   n (id age x y w h k (step age) * k) * n
+#                                       - колонии и их изменившиеся клетки
+# Изменившаяся клетка записывается шагом от предыдущей изменившейся
+# клетки (от начала окна для первой) по смещению в окне колонии
+# (y * w + x) и своим возрастом (0 для умершей клетки). Остальные клетки
+# окна имеют ожидаемый возраст, а клетки за пределами окна колонии пустые.
+
+import io
+import logging
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import colony
+import snapshot
+
+
+# Сигнатура файла журнала
+MAGIC = b"LCJRNL01"
+
+# Заголовок кадра и виды кадров
+FRAME = struct.Struct("<4sqQ")
+KEYFRAME = b"KEY "
+DELTA = b"DAY "
+
+# Число дней между ключевыми кадрами
+KEYFRAME_DAYS = 100
+
+
+
+class Journal:
+    """
+    Journal of the space changes
+
+    Keeps the file of the journal, the number of days between keyframes,
+    windows of the colonies on the last recorded day (look windows),
+    removals and merges of the colonies of the current day and the number
+    of bytes written.
+    """
+    __slots__ = ("file", "keyframes", "windows", "removals", "merges",
+                 "size")
+
+    def __init__(self, path, space, keyframes = KEYFRAME_DAYS):
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.keyframes = keyframes
+        self.windows = windows(space)
+        self.removals = []
+        self.merges = []
+        self.size = 0
+        space.journal = self
+        self.write(KEYFRAME, space.age, keyframe(space))
+        logging.info("Journal of the space [%s] is started in [%s] on %d " \
+                     "day.", space.name, path, space.age)
+
+    def removed(self, col):
+        """
+        Records removal of the dead colony
+        """
+        self.removals.append(col.id)
+
+    def merged(self, keep, members):
+        """
+        Records merging of the colonies into the keep one
+        """
+        self.merges.append((keep.id, [col.id for col in members
+                                      if col is not keep]))
+
+    def record(self, space):
+        """
+        Records changes of the finished day of the space
+
+        The keyframe is written as well every keyframes days.
+        """
+        old = self.windows
+        for col_id in self.removals:
+            old.pop(col_id, None)
+        data = array("q", [space.origin_x, space.origin_y,
+                           len(self.removals)])
+        data.extend(self.removals)
+        data.append(len(self.merges))
+        for keep_id, ids in self.merges:
+            data.extend((keep_id, len(ids)))
+            data.extend(ids)
+            # Поглощенные клетки продолжают стареть в колонии keep_id
+            for col_id in ids:
+                old.setdefault(keep_id, []).extend(old.pop(col_id, []))
+        self.removals = []
+        self.merges = []
+
+        self.windows = {}
+        data.append(len(space.colonies))
+        for col in space.colonies:
+            cells = colony.copy_cells(col)
+            changes = window_changes(cells,
+                                     expected_cells(col.x, col.y, col.w,
+                                                    col.h,
+                                                    old.get(col.id, [])))
+            data.extend((col.id, col.age, col.x, col.y, col.w, col.h,
+                         len(changes) // 2))
+            data.extend(changes)
+            self.windows[col.id] = [(col.x, col.y, col.w, col.h, cells)]
+
+        if sys.byteorder != "little":
+            data.byteswap()
+        self.write(DELTA, space.age, zlib.compress(data.tobytes()))
+        if space.age % self.keyframes == 0:
+            self.write(KEYFRAME, space.age, keyframe(space))
+
+    def write(self, kind, day, payload):
+        """
+        Appends the frame to the journal
+        """
+        self.file.write(FRAME.pack(kind, day, len(payload)))
+        self.file.write(payload)
+        self.file.flush()
+        self.size += FRAME.size + len(payload)
+        logging.debug("Frame [%s] of %d bytes is written for %d day.",
+                      kind.decode().strip(), len(payload), day)
+
+    def close(self, space):
+        """
+        Detaches the journal from the space and closes its file
+        """
+        space.journal = None
+        self.file.close()
+        logging.info("Journal of the space [%s] is closed on %d day, " \
+                     "%d bytes written.", space.name, space.age, self.size)
+
+
+
+class JournalReader:
+    """
+    Reader of the space journal
+
+    Keeps the file of the journal and the list of its frames as
+    (kind, day, position, length).
+    """
+    __slots__ = ("path", "frames")
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = []
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("[{}] is not a space journal".format(path))
+            size = os.fstat(f.fileno()).st_size
+            while True:
+                header = f.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    break
+                kind, day, length = FRAME.unpack(header)
+                pos = f.tell()
+                # Недописанный последний кадр пропускается
+                if pos + length > size:
+                    logging.error("Journal [%s] is cut on %d day.", path, day)
+                    break
+                f.seek(pos + length)
+                self.frames.append((kind, day, pos, length))
+
+    def days(self):
+        """
+        Returns sorted list of the recorded days
+        """
+        return sorted({day for kind, day, pos, length in self.frames})
+
+    def space(self, day):
+        """
+        Rebuilds the space of given day
+
+        The newest keyframe not later than the day is loaded and
+        the following changes are applied up to the day.
+
+        Returns the space or None if the day could not be rebuilt
+        """
+        start = None
+        for i, (kind, frame_day, pos, length) in enumerate(self.frames):
+            if kind == KEYFRAME and frame_day <= day:
+                start = i
+        if start is None:
+            return None
+
+        with open(self.path, "rb") as f:
+            kind, frame_day, pos, length = self.frames[start]
+            f.seek(pos)
+            data = zlib.decompress(f.read(length))
+            space = snapshot.read(memoryview(data), self.path)
+            old = windows(space)
+            headers = [(col.id, col.age, col.x, col.y, col.w, col.h)
+                       for col in space.colonies]
+            for kind, frame_day, pos, length in self.frames[start + 1:]:
+                if kind != DELTA or frame_day <= space.age:
+                    continue
+                if frame_day > day:
+                    break
+                f.seek(pos)
+                data = array("q")
+                data.frombytes(zlib.decompress(f.read(length)))
+                if sys.byteorder != "little":
+                    data.byteswap()
+                old, headers = apply_day(space, old, data)
+                space.age = frame_day
+        if space.age != day:
+            return None
+
+        space.colonies = []
+        for col_id, age, x, y, w, h in headers:
+            col = colony.Colony(x, y, col_id, age)
+            col.set_cells(old[col_id][0][4], w, h)
+            space.colonies.append(col)
+
+        return space
+
+
+
+def windows(space):
+    """
+    Returns windows of the colonies of the space
+
+    Windows of every colony are kept by its number as the list of
+    (x, y, w, h, cells), where cells are the copy of the colony window.
+    The colony has several windows only after merging, till the journal
+    records its new state.
+    """
+    return {col.id: [(col.x, col.y, col.w, col.h, colony.copy_cells(col))]
+            for col in space.colonies}
+
+
+
+def expected_cells(x, y, w, h, old):
+    """
+    Returns expected ages of the cells of the colony window
+
+    x, y, w and h are the place and the size of the window of the colony
+    and old are the windows of the colony on the previous day. Live cells
+    of old windows get one day older, cells outside of them are empty.
+    """
+    expected = colony.empty_cells(w * h)
+    for ox, oy, ow, oh, cells in old:
+        left, right = max(x, ox), min(x + w, ox + ow)
+        top, bottom = max(y, oy), min(y + h, oy + oh)
+        if left < right and top < bottom:
+            colony.copy_window(expected, (top - y) * w + left - x, w,
+                               cells, (top - oy) * ow + left - ox, ow,
+                               right - left, bottom - top)
+
+    return colony.age_cells(expected)
+
+
+
+def window_changes(cells, expected):
+    """
+    Returns changed cells of the colony window
+
+    Returns array of (step, age) of the cells of the window, which ages
+    differ from the expected ones, where step is the offset of the cell
+    from the previous changed cell (from the start of the window for
+    the first one)
+    """
+    if cells == expected:
+        return array("q")
+
+    if np is not None:
+        ages = np.frombuffer(cells, dtype = np.uintc)
+        offsets = np.flatnonzero(ages != np.frombuffer(expected,
+                                                       dtype = np.uintc))
+        changes = np.empty(2 * len(offsets), dtype = np.int64)
+        changes[0::2] = np.diff(offsets, prepend = 0)
+        changes[1::2] = ages[offsets]
+        return array("q", changes.tobytes())
+
+    changes = array("q")
+    last = 0
+    for i, (age, old) in enumerate(zip(cells, expected)):
+        if age != old:
+            changes.extend((i - last, age))
+            last = i
+
+    return changes
+
+
+
+def keyframe(space):
+    """
+    Returns compressed snapshot of the space
+    """
+    f = io.BytesIO()
+    snapshot.dump(snapshot.capture(space), f)
+
+    return zlib.compress(f.getvalue())
+
+
+
+def apply_day(space, old, data):
+    """
+    Applies changes of the day to the windows of the colonies
+
+    Sets the origin of the space from the changes.
+
+    Returns windows (look windows) and headers (id, age, x, y, w, h) of
+    the colonies of the day
+    """
+    it = iter(data)
+    space.origin_x, space.origin_y = next(it), next(it)
+    for i in range(next(it)):
+        old.pop(next(it), None)
+    for i in range(next(it)):
+        keep_id = next(it)
+        for j in range(next(it)):
+            old.setdefault(keep_id, []).extend(old.pop(next(it), []))
+
+    new = {}
+    headers = []
+    for i in range(next(it)):
+        col_id, age, x, y, w, h = (next(it) for j in range(6))
+        cells = expected_cells(x, y, w, h, old.get(col_id, []))
+        offset = 0
+        for j in range(next(it)):
+            offset += next(it)
+            cells[offset] = next(it)
+        new[col_id] = [(x, y, w, h, cells)]
+        headers.append((col_id, age, x, y, w, h))
+
+    return new, headers
@@ -8,10 +8,13 @@
 #
 # viewport - Подвижная лупа через которую смотрят на space.
 # viewport = [space, screen, x, y, w, h, offset]
-# space - Пространство которое мы наблюдаем
+# space - Пространство которое мы наблюдаем (объект colony.Space)
 # screen - Эктран на котором мы рисуем
 # x, y, w, h, - Начальные кардинаты и размеры viewport (еденица измерения в клетках)
 # offset - Отступы в точках от границ экрана
+#
+# Пространство изменяется в фоновом потоке (simulation.py), а viewport
+# отображает самый новый снимок пространства.
 
 import logging
 import os.path
@@ -20,6 +23,7 @@ import pygame
 import pygame.locals
 
 import colony
+import simulation
 
 # Define some colors
 C_HDR_TEXT   = ( 255, 242,   0)
@@ -62,7 +66,7 @@ E_OFFSET = 30
 S_OFFSET = 30 + SBAR_SIZE + 4
 W_OFFSET = 0
 
-SPEED_NAME = ("SLW", "NRM", "FST")
+SPEED_NAME = ("SLW", "NRM", "FST", "MAX")
 
 def grp_init(size, spc_name):
     """
@@ -115,14 +119,13 @@ def vport_center_on(vport, active_col):
     """
     Centers viewport over the active colony
     """
-    if active_col >= 0 and active_col <= len(vport[0]) - 3:
+    if active_col >= 0 and active_col <= len(vport[0].colonies) - 1:
         # Найти центр активной колонии
         #       xc = col_x + col_w / 2
         #       yc = col_y + col_h / 2
-        x = int(vport[0][2 + active_col][0][1]
-                + vport[0][2 + active_col][0][3] / 2)
-        y = int(vport[0][2 + active_col][0][2]
-                + vport[0][2 + active_col][0][4] / 2)
+        col = vport[0].colonies[active_col]
+        x = int(col.x - vport[0].origin_x + col.w / 2)
+        y = int(col.y - vport[0].origin_y + col.h / 2)
         # Найти левый-верхний край viewport
         #       xv = xc - vport_w / 2
         #       yv = yc - vport_h / 2
@@ -199,7 +202,7 @@ def viewport_init(space, active_col, screen, offset):
     vport_center_on(vport, active_col)
 
     logging.debug("Viewport for space %s created [%d, %d, %d, %d]",
-                  space[0], vport[2], vport[3], vport[4], vport[5])
+                  space.name, vport[2], vport[3], vport[4], vport[5])
 
     return vport
 
@@ -252,13 +255,15 @@ def draw_minimap(vport):
                      pygame.Rect(0, 0, MINIMAP_SIZE + 2, MINIMAP_SIZE + 2), 1)
 
     # Отобразить все колонии
-    for col in vport[0][2:]:
+    for col in vport[0].colonies:
         # Поскольку колонии очень малы по отношению к space
         # отобразить центр колонии
         # xcc = xc + w / 2
         # ycc = yc + h / 2
-        xcc = 1 + v_offset + int((col[0][1] + col[0][3] / 2) / scale)
-        ycc = 1 + h_offset + int((col[0][2] + col[0][4] / 2) / scale)
+        xcc = 1 + v_offset + int((col.x - vport[0].origin_x + col.w / 2)
+                                 / scale)
+        ycc = 1 + h_offset + int((col.y - vport[0].origin_y + col.h / 2)
+                                 / scale)
         pygame.draw.line(surf, C_MM_COLONY,
                          (xcc, ycc), (xcc, ycc), 1)
 
@@ -291,53 +296,58 @@ def draw_vport(vport):
                         size[0] - vport[6][3] - vport[6][1],
                         size[1] - vport[6][0] - vport[6][2]))
 
-    for col in vport[0][2:]:
+    for col in vport[0].colonies:
+        # Перевести координаты колонии в координаты от начала отсчета
+        # пространства
+        x = col.x - vport[0].origin_x
+        y = col.y - vport[0].origin_y
         # Проверить попадание левого нижнего угла колонии во viewport
         # (xc <= xv + wv - 1 and xc >= xv) and
         # (yc + hc - 1 >= yv and yc + hc - 1 <= yv + hv - 1)
-        if (((col[0][1] <= vport[2] + vport[4] - 1 and col[0][1] >= vport[2])
-             and (col[0][2] + col[0][4] - 1 >= vport[3] 
-                  and col[0][2] + col[0][4] - 1 <= vport[3] + vport[5] - 1))
+        if (((x <= vport[2] + vport[4] - 1 and x >= vport[2])
+             and (y + col.h - 1 >= vport[3] 
+                  and y + col.h - 1 <= vport[3] + vport[5] - 1))
            # Проверить пападание правого нижнего угла колонии во viewport
            # (xc + wc - 1 >= xv and xc + wc - 1 <= xv + wv - 1)
            # and (yc + hc - 1 >= yv and yc + hc - 1 <= yv + hv - 1)
-            or ((col[0][1] + col[0][3] - 1 >= vport[2]
-                 and col[0][1] + col[0][3] - 1 <= vport[2] + vport[4] - 1)
-                and (col[0][2] + col[0][4] - 1 >= vport[3]
-                     and col[0][2] + col[0][4] - 1 <= vport[3] + vport[5] - 1))
+            or ((x + col.w - 1 >= vport[2]
+                 and x + col.w - 1 <= vport[2] + vport[4] - 1)
+                and (y + col.h - 1 >= vport[3]
+                     and y + col.h - 1 <= vport[3] + vport[5] - 1))
           # Проверить попадания левого верхнего угла колонии во viewport
           # (xc >= xv and xc <= xv + wv - 1) 
           # and (yc >= yv and yc <= yv + hv - 1)
-            or ((col[0][1] >= vport[2] 
-                 and col[0][1] <= vport[2] + vport[4] - 1)
-                and (col[0][2] >= vport[3] 
-                     and col[0][2] <= vport[3] + vport[5] - 1))
+            or ((x >= vport[2] 
+                 and x <= vport[2] + vport[4] - 1)
+                and (y >= vport[3] 
+                     and y <= vport[3] + vport[5] - 1))
           # Проверить попадение правого верхнего угла колонии во viewport
           # (xc + wc - 1 >= xv and xc + wc - 1 <= xv + wv - 1)
           # and (yc >= yv and yc <= yv + hv - 1)
-            or ((col[0][1] + col[0][3] - 1 >= vport[2]
-                 and col[0][1] + col[0][3] - 1 <= vport[2] + vport[4] - 1)
-                and (col[0][2] >= vport[3]
-                     and col[0][2] <= vport[3] + vport[5] - 1))):
-            for yc, row in enumerate(col[1]):
-                yc += col[0][2]
-                for xc, cell in enumerate(row):
+            or ((x + col.w - 1 >= vport[2]
+                 and x + col.w - 1 <= vport[2] + vport[4] - 1)
+                and (y >= vport[3]
+                     and y <= vport[3] + vport[5] - 1))):
+            for yc in range(col.h):
+                row = col.row(yc)
+                yc += y
+                for xc, age in enumerate(row):
                     # Для каждой живой клетки колонии,
                     # проверить попадание во viewport
                     # (xc >= xv and xc <= xv + wv - 1)
                     # and (yc >= yv and yc <= yv + hv - 1)
                     # Найти кординаты клетки в space
-                    xc += col[0][1]
-                    if (cell[0] > 0
+                    xc += x
+                    if (age > 0
                        and ((xc >= vport[2] 
                              and xc <= vport[2] + vport[4] - 1)
                             and (yc >= vport[3]
                                  and yc <= vport[3] + vport[5] - 1))):
                         # Определить цвет клетки в зависимости от ее возраста
-                        if cell[0] > 9:
+                        if age > 9:
                             cIdx = 0
                         else:
-                            cIdx = cell[0]
+                            cIdx = age
                         # Найти положение клетки внутри viewport
                         # xcv = xc - xv
                         # ycv = yc - yv
@@ -362,13 +372,16 @@ def get_space_size(space):
     Get space size with help colonies
     """
     w, h = 0, 0 
-    for col in space[2:]:
+    for col in space.colonies:
+        # Координаты колоний отсчитываются от начала отсчета пространства
+        x = col.x - space.origin_x
+        y = col.y - space.origin_y
         # Если xс + wс > ws, присвоить ws значение xс + wс
-        if col[0][1] + col[0][3] > w:
-            w = col[0][1] + col[0][3]
+        if x + col.w > w:
+            w = x + col.w
         # Если yс + hс > hs, присвоить hs значение yс + hс
-        if col[0][2] + col[0][4] > h:
-            h = col[0][2] + col[0][4]
+        if y + col.h > h:
+            h = y + col.h
         
     return w, h
 
@@ -401,12 +414,12 @@ def info_space(space, screen, active_col):
     spc_size = get_space_size(space)
     spc_sz   = font.render("        " + str(spc_size[0]) + " , " + str(spc_size[1]),
                            True, C_VAL_TEXT)
-    nbr_cols = font.render("                              " + str(len(space) - 2),
+    nbr_cols = font.render("                              " + str(len(space.colonies)),
                            True, C_VAL_TEXT)
     actv_col = font.render("                                               "
                            + str(active_col), True, C_VAL_TEXT)
     age_spc  = font.render("                                                            "
-                           + str(space[1]), True, C_VAL_TEXT)
+                           + str(space.age), True, C_VAL_TEXT)
 
     # Вывести сделанную картинку на экран в точке (250, 250)
     surf.blit(hdr, [10,int((N_OFFSET - 16) / 2)])
@@ -610,23 +623,26 @@ def run(space = None):
     if space == None:   
         space = init_space()
 
-    screen = grp_init((SCR_MIN_WIDTH, SCR_MIN_HEIGHT), space[0])
-
-    vport = viewport_init(space, active_col, screen, 
-                         (N_OFFSET, E_OFFSET, S_OFFSET, W_OFFSET))
+    screen = grp_init((SCR_MIN_WIDTH, SCR_MIN_HEIGHT), space.name)
 
     clock = pygame.time.Clock()
     # space day change speed
     # it could be:
-    #       - slow   ( 1 day per 5 seconds)
-    #       - normal ( 1 day per second) 
-    #       - fast   ( 5 days per second)
-    speed_steps = (5000, 1000, 200) # time in milliseconds to change a day
+    #       - slow      ( 1 day per 5 seconds)
+    #       - normal    ( 1 day per second) 
+    #       - fast      ( 5 days per second)
+    #       - unlimited ( as fast as the engine can)
+    speed_steps = (5000, 1000, 200, 0) # time in milliseconds to change a day
     curr_speed = 1
-    pygame.time.set_timer(pygame.USEREVENT, speed_steps[curr_speed])
-    
+    sim = simulation.Simulation(space, speed_steps[curr_speed] / 1000)
+    sim.start()
+    # Отображаемый снимок пространства
+    view = sim.latest()
+
+    vport = viewport_init(view, active_col, screen, 
+                         (N_OFFSET, E_OFFSET, S_OFFSET, W_OFFSET))
+
     done = False
-    newDay = False
     w, h = 0, 0
     
     help = False
@@ -641,12 +657,6 @@ def run(space = None):
 
         # --- Main event loop
         for event in pygame.event.get():
-            # Обработать события таймера,
-            # запускающего новый день
-            if event.type == pygame.USEREVENT:
-                logging.debug("[EVT] New day.")
-                newDay = True
-
             if event.type == pygame.QUIT:
                 done = True
                 logging.debug("[EVT] Quit")
@@ -674,7 +684,7 @@ def run(space = None):
             if event.type == pygame.MOUSEMOTION:
                 if h_runner or v_runner or mm_move:
                     mx, my = pygame.mouse.get_rel()
-                    w, h = get_space_size(space)
+                    w, h = get_space_size(view)
                     s_rect = screen.get_rect()
 
                 if h_runner:
@@ -740,7 +750,7 @@ def run(space = None):
                     # Найти значения x, y курсора внутри minimap
                     mmx = mx
                     mmy = my - (s_rect.h - MINIMAP_SIZE)
-                    w, h = get_space_size(space)
+                    w, h = get_space_size(view)
                     h_offset, v_offset = 0, 0
                     scale = 0.0
                     if w > h:
@@ -802,8 +812,8 @@ def run(space = None):
 
                 elif event.key == pygame.K_n: # select next colony as active
                     active_col += 1
-                    if active_col > len(space) - 3:
-                        active_col = len(space) - 3
+                    if active_col > len(view.colonies) - 1:
+                        active_col = len(view.colonies) - 1
                     vport_center_on(vport, active_col)
                 
                 # center viewport on the active_col
@@ -860,34 +870,35 @@ def run(space = None):
                 elif event.key == pygame.K_s:   # make speed slower
                     if curr_speed > 0:
                         curr_speed -= 1
-                        pygame.time.set_timer(pygame.USEREVENT,
-                                              speed_steps[curr_speed])
+                        sim.set_delay(speed_steps[curr_speed] / 1000)
                 elif event.key == pygame.K_f:   # make speed faster
-                    if curr_speed < 2:
+                    if curr_speed < len(speed_steps) - 1:
                         curr_speed += 1
-                        pygame.time.set_timer(pygame.USEREVENT,
-                                              speed_steps[curr_speed])
+                        sim.set_delay(speed_steps[curr_speed] / 1000)
 
         # --- Game logic should go here
-        if newDay:
-            nCol = len(space) - 3
-            colony.next_day(space)
-            if len(space) < 3:
+        # Взять самый новый снимок пространства
+        snap = sim.latest()
+        if snap is not view:
+            logging.debug("[EVT] New day %d.", snap.age)
+            nCol = len(view.colonies) - 1
+            view = snap
+            vport[0] = view
+            if len(view.colonies) == 0:
                 done = True
                 continue
-            if nCol != len(space) - 3:
-                if active_col > len(space) - 3:
-                    active_col = len(space) - 3
+            if nCol != len(view.colonies) - 1:
+                if active_col > len(view.colonies) - 1:
+                    active_col = len(view.colonies) - 1
                 update_vport_size(vport)
                 vport_center_on(vport, active_col)
-            newDay = False
 
         # Если сдвиг по вертикали(v_shift)
         # либо по горизонтали(h_shift) не равен нулю,
         # сдвинуть viewport на необходимое количество клеток
         # [space, screen, x, y, w, h, offset]
         if v_shift != 0 or h_shift != 0:
-            w, h = get_space_size(space)
+            w, h = get_space_size(view)
             if vport[4] >= w:
                 vport[2] = 0
             else:
@@ -921,7 +932,7 @@ def run(space = None):
         # --- Drawing code should go here      
         draw_vport(vport)
         draw_minimap(vport)
-        info_space(space, screen, active_col)
+        info_space(view, screen, active_col)
         speed_info(screen, curr_speed)
         if help:
             draw_help(screen)
@@ -935,6 +946,7 @@ def run(space = None):
         clock.tick(60)
 
     # Close the window and quit.
+    sim.stop()
     pygame.quit()
 
 
@@ -952,7 +964,7 @@ def main():
 
     if os.path.isfile("lifecells.lcsf"):
         with open("lifecells.lcsf") as f:
-            space = colony.load_from_file(f) 
+            space = colony.load_stream(f)
     else:
         space = None
 
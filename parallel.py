@@ -0,0 +1,440 @@
+# parallel.py
+#
+# EnesGUL12, dr-dobermann, 2018.
+#
+# https://github.com/EnesGUL12/LifeCells.git
+#
+# Параллельное обновление колоний пространства из библиотеки colony.py
+#
+# До проверки соприкосновения колоний каждая колония за день изменяется
+# независимо от остальных, поэтому колонии обновляются в пуле процессов.
+# Клетки колоний не передаются процессам через pickle. Все колонии дня
+# копируются в общий блок памяти src, а процессы записывают обновленные
+# колонии в общий блок памяти dst. Колония за день может вырасти не более
+# чем на одну клетку с каждой стороны (новая колония - еще на одну при
+# добавлении пустой рамки), поэтому место для нее в dst выделяется заранее.
+# Процессам передаются и от них возвращаются только заголовки колоний.
+#
+# Колония, площадь которой не меньше TILE_CELLS, делится на полосы строк,
+# которые рассчитываются разными процессами. Для расчета полосы процесс
+# читает из src и соседние строки колонии (гало), которые рассчитывают
+# соседние процессы, поэтому полосы обмениваются гало через общую память
+# каждый день. Полосы рассчитываются по битовым строкам, как в движке
+# bitboard, с сохранением возраста клеток, поэтому результат совпадает
+# с любым движком, сохраняющим возраст.
+
+import logging
+import multiprocessing
+import random
+import sys
+import time
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+
+import colony
+
+
+# Размер клетки в общей памяти
+CELL_BYTES = array("I").itemsize
+
+# Число заданий на один процесс пула
+CHUNKS_PER_WORKER = 4
+
+# Наименьшая площадь колонии, которая рассчитывается полосами
+TILE_CELLS = 128 * 128
+
+# Общие блоки памяти, к которым подключен процесс пула
+_blocks = {}
+
+
+
+class ColonyPool:
+    """
+    Pool of processes updating colonies
+
+    Keeps the pool of processes and shared memory blocks for source
+    and updated cells of the colonies. Blocks grow on demand and are
+    reused from day to day.
+    """
+    __slots__ = ("pool", "workers", "src", "dst")
+
+    def __init__(self, workers):
+        # Процессы пула должны использовать общий с основным процессом
+        # учет общих блоков памяти, иначе при завершении они удалят блоки
+        # основного процесса
+        resource_tracker.ensure_running()
+        self.pool = multiprocessing.Pool(workers)
+        self.workers = workers
+        self.src = None
+        self.dst = None
+
+    def update(self, colonies, engine):
+        """
+        Updates colonies for one day with given engine
+
+        Colonies are updated in place, as if the engine was called for
+        every colony in turn. Large colonies are split into stripes of rows
+        updated by all the processes of the pool.
+        """
+        # Крупные колонии рассчитываются полосами, если движок сохраняет
+        # возраст клеток
+        tiled = set()
+        if self.workers > 1 and engine != "bitboard_noage":
+            for col in colonies:
+                if col.w * col.h >= TILE_CELLS:
+                    if col.age == 0:
+                        colony.col_init(col)
+                    if col.h > 0:
+                        tiled.add(col)
+
+        tasks = []
+        src_size, dst_size = 0, 0
+        for col in colonies:
+            tasks.append((src_size, dst_size, col.w, col.h, col.x, col.y,
+                          col.age, col.id, col.changed))
+            src_size += col.w * col.h
+            # Новая колония еще получит пустую рамку при инициализации
+            grow = 2 if col.age > 0 else 4
+            dst_size += (col.w + grow) * (col.h + grow)
+        self.src = reserve_block(self.src, src_size)
+        self.dst = reserve_block(self.dst, dst_size)
+
+        src = self.src.buf.cast("I")
+        for col, task in zip(colonies, tasks):
+            start = task[0]
+            if col.stride == col.w:
+                src[start:start + col.w * col.h] = col.cells[
+                    col.off:col.off + col.w * col.h]
+            else:
+                for y in range(col.h):
+                    src[start:start + col.w] = col.row(y)
+                    start += col.w
+        src.release()
+
+        # Распределить колонии по заданиям так, чтобы площади колоний
+        # в заданиях были близки
+        small = [i for i, col in enumerate(colonies) if col not in tiled]
+        chunks = [[] for i in range(min(self.workers * CHUNKS_PER_WORKER,
+                                        len(small)))]
+        order = sorted(small, key = lambda i: -tasks[i][2] * tasks[i][3])
+        for n, i in enumerate(order):
+            chunks[n % len(chunks)].append(i)
+        jobs = [("chunk", self.src.name, self.dst.name, engine,
+                 [tasks[i] for i in chunk]) for chunk in chunks]
+
+        # Разделить крупные колонии на полосы по числу процессов
+        stripes = []
+        for i, col in enumerate(colonies):
+            if col in tiled:
+                h = col.h + 2
+                for n in range(self.workers):
+                    y0 = h * n // self.workers
+                    y1 = h * (n + 1) // self.workers
+                    if y1 > y0:
+                        stripes.append(i)
+                        jobs.append(("tile", self.src.name, self.dst.name,
+                                     tasks[i][0], tasks[i][1], col.w, col.h,
+                                     y0, y1))
+        results = self.pool.map(update_task, jobs)
+
+        dst = self.dst.buf
+        for chunk, headers in zip(chunks, results):
+            for i, (w, h, x, y, age, changed) in zip(chunk, headers):
+                col = colonies[i]
+                start = tasks[i][1] * CELL_BYTES
+                cells = array("I")
+                cells.frombytes(dst[start:start + w * h * CELL_BYTES])
+                col.set_cells(cells, w, h)
+                col.x, col.y, col.age, col.changed = x, y, age, changed
+
+        boxes = {}
+        for i, box in zip(stripes, results[len(chunks):]):
+            if box is not None:
+                boxes.setdefault(i, []).append(box)
+        for i, col in enumerate(colonies):
+            if col in tiled:
+                join_stripes(col, dst, tasks[i][1], boxes.get(i))
+        logging.debug("%d colonies updated by %d processes in %d chunks " \
+                      "and %d stripes.", len(colonies), self.workers,
+                      len(chunks), len(stripes))
+
+    def close(self):
+        """
+        Stops the processes and frees shared memory
+        """
+        self.pool.close()
+        self.pool.join()
+        for block in (self.src, self.dst):
+            if block is not None:
+                block.close()
+                block.unlink()
+        self.src = self.dst = None
+
+
+
+def new_pool(workers = None):
+    """
+    Creates the pool of processes updating colonies
+
+    workers is the number of processes. By default it equals to the number
+    of CPUs.
+
+    Returns new pool
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    logging.info("Pool of %d processes is started.", workers)
+
+    return ColonyPool(workers)
+
+
+
+def reserve_block(block, cells):
+    """
+    Returns shared memory block for at least given number of cells
+
+    The block is reallocated with a reserve if it is too small.
+    """
+    cells = max(cells, 1)
+    if block is not None:
+        if block.size >= cells * CELL_BYTES:
+            return block
+        block.close()
+        block.unlink()
+
+    return shared_memory.SharedMemory(create = True,
+                                      size = (cells + cells // 2) * CELL_BYTES)
+
+
+
+def attach(name):
+    """
+    Returns shared memory block with given name for the pool process
+    """
+    block = _blocks.get(name)
+    if block is None:
+        block = shared_memory.SharedMemory(name)
+        _blocks[name] = block
+
+    return block
+
+
+
+def join_stripes(col, dst, start, boxes):
+    """
+    Makes the colony from its stripes updated by the pool
+
+    Stripes are written into the dst block from start position as rows of
+    the colony with one more cell on every side. boxes are edges of live
+    cells of the stripes.
+    """
+    if boxes is None:
+        colony.col_clear(col)
+        col.age += 1
+        return
+
+    minX = min(box[0] for box in boxes)
+    maxX = max(box[1] for box in boxes)
+    minY = min(box[2] for box in boxes)
+    maxY = max(box[3] for box in boxes)
+    stride = col.w + 2
+    w = maxX - minX + 1
+    cells = colony.empty_cells(w + 2)
+    for y in range(minY, maxY + 1):
+        row = (start + y * stride + minX) * CELL_BYTES
+        cells.append(0)
+        cells.frombytes(dst[row:row + w * CELL_BYTES])
+        cells.append(0)
+    cells.extend(colony.empty_cells(w + 2))
+    col.set_cells(cells, w + 2, maxY - minY + 1 + 2)
+
+    # Строки полос сдвинуты на одну клетку относительно колонии
+    col.x += minX - 2
+    col.y += minY - 2
+    col.age += 1
+    col.changed = None
+    logging.info("Colony #%d has dimension [%d, %d, %d, %d].",
+                 col.id, col.x, col.y, col.w, col.h)
+
+
+
+def update_task(task):
+    """
+    Runs the task in the pool process
+
+    The task is a chunk of colonies (look update_chunk) or a stripe
+    of the colony (look update_tile).
+    """
+    kind, src_name, dst_name = task[:3]
+    # Отключиться от блоков, замененных на более крупные
+    for name in list(_blocks):
+        if name not in (src_name, dst_name):
+            _blocks.pop(name).close()
+
+    if kind == "tile":
+        return update_tile(*task[1:])
+
+    return update_chunk(*task[1:])
+
+
+
+def update_chunk(src_name, dst_name, engine, headers):
+    """
+    Updates a chunk of colonies in the pool process
+
+    Cells of the colonies are read from the src block and updated cells
+    are written into the dst block.
+
+    Returns headers of updated colonies
+    """
+    src = attach(src_name).buf
+    dst = attach(dst_name).buf.cast("I")
+    results = []
+    for src_start, dst_start, w, h, x, y, age, col_id, changed in headers:
+        col = colony.Colony(x, y, col_id, age)
+        cells = array("I")
+        src_start *= CELL_BYTES
+        cells.frombytes(src[src_start:src_start + w * h * CELL_BYTES])
+        col.set_cells(cells, w, h)
+        col.changed = changed
+        colony.ENGINES[engine](col)
+
+        for row in range(col.h):
+            dst[dst_start:dst_start + col.w] = col.row(row)
+            dst_start += col.w
+        results.append((col.w, col.h, col.x, col.y, col.age, col.changed))
+    dst.release()
+
+    return results
+
+
+
+def update_tile(src_name, dst_name, src_start, dst_start, w, h, y0, y1):
+    """
+    Updates a stripe of the colony in the pool process
+
+    The colony of w * h cells is read from src_start position of the src
+    block. Updated colony could grow by one cell on every side, so it
+    takes (w + 2) * (h + 2) cells from dst_start position of the dst block
+    and the stripe is rows from y0 to y1 (not including) of it.
+    Rows of the stripe and one halo row from both sides are read from
+    the src block.
+
+    Returns edges of live cells of the stripe (minX, maxX, minY, maxY)
+    or None if there are no live cells in it
+    """
+    src = attach(src_name).buf
+    dst = attach(dst_name).buf.cast("I")
+    stride = w + 2
+
+    # Строка y обновленной колонии соответствует строке y - 1 колонии
+    old = {}
+    rows = []
+    for y in range(y0 - 2, y1):
+        if 0 <= y < h:
+            start = (src_start + y * w) * CELL_BYTES
+            old[y] = array("I")
+            old[y].frombytes(src[start:start + w * CELL_BYTES])
+            rows.append(colony.row_bits(old[y]) << 1)
+        else:
+            rows.append(0)
+    nrows = colony.bits_step(rows, stride)[1:-1]
+
+    minX, maxX, minY, maxY = stride, -1, y1, -1
+    for y, r in zip(range(y0, y1), nrows):
+        row = colony.empty_cells(stride)
+        if r:
+            minX = min(minX, (r & -r).bit_length() - 1)
+            maxX = max(maxX, r.bit_length() - 1)
+            minY = min(minY, y)
+            maxY = y
+            prev = old.get(y - 1)
+            # Возраст живой клетки на один день больше, чем был
+            while r:
+                x = (r & -r).bit_length() - 1
+                if prev is not None and 1 <= x <= w:
+                    row[x] = prev[x - 1] + 1
+                else:
+                    row[x] = 1
+                r &= r - 1
+        start = dst_start + y * stride
+        dst[start:start + stride] = row
+    dst.release()
+
+    if maxY < 0:
+        return None
+
+    return minX, maxX, minY, maxY
+
+
+
+def benchmark(size = 512, days = 10, workers = None):
+    """
+    Measures the speed of updating one giant colony
+
+    The random colony of size * size cells is updated for given amount
+    of days by the bitboard engine in the main process and by stripes
+    in the pools of 2, 4, 8... processes up to workers (the number of CPUs
+    by default). Results of the pools are checked to be the same as
+    the result of the main process.
+
+    Returns list of (number of processes, generations per second)
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    mask = ["".join(random.choice("0001") for x in range(size))
+            for y in range(size)]
+
+    results = []
+    reference = None
+    counts = [1]
+    while counts[-1] * 2 <= max(workers, 1):
+        counts.append(counts[-1] * 2)
+    if counts[-1] != workers and workers > 1:
+        counts.append(workers)
+    for count in counts:
+        space = colony.add_colony(colony.new_space("Benchmark"), mask, 0, 0)
+        pool = new_pool(count) if count > 1 else None
+        start = time.perf_counter()
+        for day in range(days):
+            colony.next_day(space, "bitboard", pool)
+        speed = days / (time.perf_counter() - start)
+        if pool is not None:
+            pool.close()
+
+        state = [(col.x, col.y, [list(col.row(y)) for y in range(col.h)])
+                 for col in space.colonies]
+        if reference is None:
+            reference = state
+        elif state != reference:
+            logging.error("Result of %d processes differs from the result " \
+                          "of the main process.", count)
+        results.append((count, speed))
+        print("%3d processes: %8.2f generations/sec" % (count, speed))
+
+    return results
+
+
+
+###############################################################################
+# Main function
+###############################################################################
+def main():
+    """
+    Programm entry point
+
+    Measures the speed of updating one giant colony by the pool.
+    Usage: parallel.py [size [days [workers]]]
+    """
+    logging.basicConfig(level = logging.WARNING,
+                        format = "%(asctime)s [%(levelname)s] : %(message)s")
+    args = [int(arg) for arg in sys.argv[1:4]]
+    benchmark(*args)
+
+
+
+###############################################################################
+# Entry point
+###############################################################################
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+# shard.py
+#
+# EnesGUL12, dr-dobermann, 2018.
+#
+# https://github.com/EnesGUL12/LifeCells.git
+#
+# Распределенное пространство из библиотеки colony.py
+#
+# Плоскость пространства делится по оси x на полосы (регионы), каждым из
+# которых владеет отдельный процесс. Колония принадлежит региону, в который
+# попадает ее левый край. Процессы не имеют общей памяти и обмениваются
+# с координатором сообщениями через каналы (pipe), поэтому процессы могут
+# быть заменены узлами сети.
+#
+# Координатор проводит все процессы через день одновременно:
+#   update   - процессы принимают переселенные к ним колонии, обновляют
+#              свои колонии и сообщают, какую полосу по оси x занимают
+#              их живые колонии;
+#   boundary - процессы находят группы соприкасающихся колоний. Группы,
+#              которые не могут касаться колоний других процессов (не
+#              пересекаются с их полосами), сливаются сразу, а
+#              о пограничных колониях остальных групп сообщается
+#              координатору;
+#   export   - координатор находит группы, соприкасающиеся через границы
+#              регионов, и забирает их колонии у процессов, которым не
+#              принадлежит старшая колония;
+#   merge    - процессы сливают группы, получив чужие колонии, и отдают
+#              колонии, вышедшие за пределы их регионов.
+# Группы сливаются так же, как в одном процессе, поэтому результат
+# совпадает с colony.next_day.
+
+import bisect
+import logging
+import multiprocessing
+
+import colony
+
+
+
+class Shards:
+    """
+    Coordinator of the sharded space
+
+    Keeps the space, pipes and processes of the shards, left edges of
+    the shards regions (the first region has no left edge) and colonies
+    moving to the shards on the next day.
+    """
+    __slots__ = ("space", "conns", "procs", "bounds", "adopt", "alive")
+
+    def __init__(self, space, shards):
+        self.space = space
+        self.conns = []
+        self.procs = []
+        self.adopt = [[] for i in range(shards)]
+        self.alive = len(space.colonies)
+
+        # Разделить колонии поровну между регионами
+        xs = sorted(col.x for col in space.colonies)
+        self.bounds = [xs[len(xs) * k // shards] if len(xs) > 0 else 0
+                       for k in range(1, shards)]
+        for col in space.colonies:
+            self.adopt[self.owner(col.x)].append(pack(col))
+
+        for k in range(shards):
+            lo = self.bounds[k - 1] if k > 0 else None
+            hi = self.bounds[k] if k < shards - 1 else None
+            conn, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target = serve,
+                                           args = (child, space.name,
+                                                   space.age, lo, hi))
+            proc.start()
+            child.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+        logging.info("Space [%s] is split into %d shards at %s.",
+                     space.name, shards, self.bounds)
+
+    def owner(self, x):
+        """
+        Returns the number of the shard owning the colony with left edge x
+        """
+        return bisect.bisect_right(self.bounds, x)
+
+    def call(self, messages):
+        """
+        Sends the message to every shard and returns their replies
+        """
+        for conn, message in zip(self.conns, messages):
+            conn.send(message)
+
+        return [conn.recv() for conn in self.conns]
+
+    def next_day(self, engine):
+        """
+        Sets new day for all the shards
+        """
+        space = self.space
+        replies = self.call([("update", engine, adopt)
+                             for adopt in self.adopt])
+        self.adopt = [[] for conn in self.conns]
+        for span, origin_x, origin_y in replies:
+            space.origin_x = min(space.origin_x, origin_x)
+            space.origin_y = min(space.origin_y, origin_y)
+
+        # Колонии процесса могут касаться колоний процессов слева и справа
+        # от него, только если пересекаются с полосами, которые они
+        # занимают. Колонии, вышедшие за пределы региона, переселяются
+        # только в конце дня, поэтому полосы процессов могут пересекаться.
+        spans = [reply[0] for reply in replies]
+        lefts = [join_spans(spans[:k]) for k in range(len(spans))]
+        rights = [join_spans(spans[k + 1:]) for k in range(len(spans))]
+        comps = self.call([("boundary", left, right)
+                           for left, right in zip(lefts, rights)])
+
+        groups = join_shards(comps)
+        exports = [[] for conn in self.conns]
+        merges = [[] for conn in self.conns]
+        # Группа сливается в процессе, которому принадлежит ее старшая
+        # колония
+        owners = [min(group, key = lambda comp: comps[comp[0]][comp[1]][0])[0]
+                  for group in groups]
+        for group, owner in zip(groups, owners):
+            for k, key in group:
+                if k != owner:
+                    exports[k].append(key)
+        if any(exports):
+            imported = self.call([("export", keys) for keys in exports])
+            imported = [iter(cols) for cols in imported]
+        for group, owner in zip(groups, owners):
+            keys = [key for k, key in group if k == owner]
+            cols = []
+            for k, key in group:
+                if k != owner:
+                    cols.extend(next(imported[k]))
+            merges[owner].append((keys, cols))
+
+        replies = self.call([("merge", merge) for merge in merges])
+        self.alive = 0
+        for emigrants, count in replies:
+            self.alive += count + len(emigrants)
+            for col in emigrants:
+                self.adopt[self.owner(col.x)].append(col)
+
+        space.age += 1
+        logging.info("For the sharded space [%s] %d day is set. " \
+                     "%d colonies crossed %d groups across the shards.",
+                     space.name, space.age, sum(map(len, self.adopt)),
+                     len(groups))
+
+    def collect(self):
+        """
+        Gathers all the colonies of the shards into the space
+
+        Colonies are ordered by their numbers.
+
+        Returns the space
+        """
+        cols = [col for cols in self.adopt for col in cols]
+        for reply in self.call([("collect",)] * len(self.conns)):
+            cols.extend(reply)
+        cols.sort(key = lambda col: col.id)
+        self.space.colonies = cols
+        self.space.index = colony.SpaceIndex()
+
+        return self.space
+
+    def close(self):
+        """
+        Stops the processes of the shards
+        """
+        for conn in self.conns:
+            conn.send(("stop",))
+            conn.close()
+        for proc in self.procs:
+            proc.join()
+
+
+
+def pack(col):
+    """
+    Returns the copy of the colony with cells of its window only
+    """
+    ncol = colony.Colony(col.x, col.y, col.id, col.age)
+    cells = colony.empty_cells(0)
+    for y in range(col.h):
+        cells.extend(col.row(y))
+    ncol.set_cells(cells, col.w, col.h)
+    ncol.changed = col.changed
+    ncol.history = col.history
+    ncol.cycle = col.cycle
+    ncol.engine = col.engine
+
+    return ncol
+
+
+
+def join_spans(spans):
+    """
+    Returns the span (minX, maxX) covering all the spans
+
+    None means there is no span.
+    """
+    spans = [span for span in spans if span is not None]
+    if len(spans) == 0:
+        return None
+
+    return min(span[0] for span in spans), max(span[1] for span in spans)
+
+
+
+def near(col, span):
+    """
+    Checks if the colony could touch colonies in the span
+    """
+    return (len(col.cells) > 0 and span is not None
+            and col.x <= span[1] and col.x + col.w >= span[0])
+
+
+
+def join_shards(comps):
+    """
+    Finds groups of colonies touching across the shards
+
+    comps is the list of boundary groups of every shard. The group is
+    keyed by its number in the shard and has the rank of its oldest colony
+    and headers (number, x, y, w, h) of its boundary colonies.
+
+    Returns list of groups, every group is the list of (shard, key) of
+    boundary groups of several shards
+    """
+    index = colony.SpaceIndex()
+    owner = {}
+    parent = {}
+    for k, shard in enumerate(comps):
+        for key, (rank, headers) in shard.items():
+            parent[k, key] = (k, key)
+            for col_id, x, y, w, h in headers:
+                col = colony.Colony(x, y, col_id)
+                col.w, col.h = w, h
+                index.update(col)
+                owner[col] = (k, key)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for col1, comp1 in owner.items():
+        for col2 in index.query(col1):
+            comp2 = owner[col2]
+            if (comp1[0] != comp2[0] and find(comp1) != find(comp2)
+                and colony.touch(col1, col2) != 0):
+                parent[find(comp2)] = find(comp1)
+
+    groups = {}
+    for comp in parent:
+        groups.setdefault(find(comp), []).append(comp)
+
+    return [group for group in groups.values() if len(group) > 1]
+
+
+
+def serve(conn, name, age, lo, hi):
+    """
+    Runs the shard process
+
+    The shard owns colonies with left edge from lo (including) to hi
+    (not including). None means there is no limit on the side.
+    Messages of the coordinator are served until "stop" one.
+    """
+    space = colony.Space(name)
+    space.age = age
+    pending = {}
+    while True:
+        message = conn.recv()
+        command = message[0]
+        if command == "stop":
+            break
+
+        if command == "update":
+            engine, adopted = message[1:]
+            space.colonies.extend(adopted)
+            colony.remove_dead(space)
+            colony.update_colonies(space, engine)
+            colony.update_origin(space)
+            live = [col for col in space.colonies if len(col.cells) > 0]
+            span = None
+            if len(live) > 0:
+                span = (min(col.x for col in live),
+                        max(col.x + col.w for col in live))
+            conn.send((span, space.origin_x, space.origin_y))
+
+        elif command == "boundary":
+            left, right = message[1:]
+            cols = space.colonies
+            # Группы, не касающиеся колоний других процессов,
+            # сливаются сразу
+            pending = {}
+            for group in colony.find_groups(space):
+                members = [cols[i] for i in group]
+                edge = [col for col in members
+                        if near(col, left) or near(col, right)]
+                if len(edge) == 0:
+                    if len(members) > 1:
+                        colony.merge_group(space, members)
+                    continue
+                keep = min(members, key = lambda col: (-col.age, col.id))
+                pending[keep.id] = (members, (-keep.age, keep.id),
+                                    [(col.id, col.x, col.y, col.w, col.h)
+                                     for col in edge])
+            conn.send({key: (rank, headers)
+                       for key, (members, rank, headers) in pending.items()})
+
+        elif command == "export":
+            reply = []
+            for key in message[1]:
+                members = pending.pop(key)[0]
+                reply.append([pack(col) for col in members])
+                for col in members:
+                    space.index.remove(col)
+                    col.age = -1 # Пометить отданную колонию на удаление
+            conn.send(reply)
+
+        elif command == "merge":
+            for keys, imported in message[1]:
+                members = list(imported)
+                for key in keys:
+                    members.extend(pending.pop(key)[0])
+                space.colonies.extend(imported)
+                colony.merge_group(space, members)
+            # Пограничные группы, не касающиеся других регионов
+            for members, rank, headers in pending.values():
+                if len(members) > 1:
+                    colony.merge_group(space, members)
+            pending = {}
+            space.colonies = [col for col in space.colonies if col.age >= 0]
+            space.age += 1
+
+            # Отдать колонии, вышедшие за пределы региона
+            emigrants = [col for col in space.colonies if len(col.cells) > 0
+                         and ((lo is not None and col.x < lo)
+                              or (hi is not None and col.x >= hi))]
+            for col in emigrants:
+                space.colonies.remove(col)
+                space.index.remove(col)
+            conn.send(([pack(col) for col in emigrants],
+                       len(space.colonies)))
+
+        elif command == "collect":
+            conn.send([pack(col) for col in space.colonies])
+
+    conn.close()
+
+
+
+def run(space, days, engine = "python", shards = 2):
+    """
+    Runs the space in shards
+
+    Splits the space between given number of processes and runs it for
+    given amount of days or while there are colonies in it.
+
+    Returns the space with all the colonies gathered from the shards
+    """
+    if engine not in colony.ENGINES:
+        logging.error("Unknown engine [%s]. Python engine will be used.",
+                      engine)
+        engine = "python"
+
+    colony.remove_dead(space)
+    if space.age == 0:
+        colony.separate_colonies(space)
+
+    coord = Shards(space, shards)
+    try:
+        while coord.alive > 0 and days > 0:
+            coord.next_day(engine)
+            days -= 1
+        coord.collect()
+    finally:
+        coord.close()
+
+    return space
@@ -0,0 +1,147 @@
+# simulation.py
+#
+# EnesGUL12, dr-dobermann, 2018.
+#
+# https://github.com/EnesGUL12/LifeCells.git
+#
+# Фоновая симуляция пространства из библиотеки colony.py
+#
+# Пространство изменяется по дням в отдельном потоке. После каждого дня
+# поток публикует неизменяемый снимок пространства в кольцевой буфер
+# ограниченного размера. Если буфер заполнен, из него вытесняется самый
+# старый снимок. Отображение берет из буфера самый новый снимок и
+# не ожидает расчета очередного дня.
+#
+# Снимок повторяет атрибуты пространства и колоний, которые нужны для
+# отображения: snap.name, snap.age, snap.origin_x, snap.origin_y,
+# snap.colonies и col.x, col.y, col.w, col.h, col.id, col.age, col.row(y).
+
+import collections
+import logging
+import threading
+import time
+
+import colony
+
+
+# Число снимков в кольцевом буфере
+RING_SIZE = 8
+
+
+
+class ColonySnapshot:
+    """
+    Immutable snapshot of the colony
+
+    Cells of the colony window are kept in read-only memory.
+    """
+    __slots__ = ("x", "y", "w", "h", "id", "age", "cells")
+
+    def __init__(self, col):
+        self.x, self.y, self.w, self.h = col.x, col.y, col.w, col.h
+        self.id = col.id
+        self.age = col.age
+        cells = colony.empty_cells(0)
+        for y in range(col.h):
+            cells.extend(col.row(y))
+        self.cells = memoryview(cells.tobytes()).cast(cells.typecode)
+
+    def row(self, y):
+        """
+        Returns y row of the colony
+        """
+        return self.cells[y * self.w:(y + 1) * self.w]
+
+
+
+class Snapshot:
+    """
+    Immutable snapshot of the space
+    """
+    __slots__ = ("name", "age", "origin_x", "origin_y", "colonies")
+
+    def __init__(self, space):
+        self.name = space.name
+        self.age = space.age
+        self.origin_x = space.origin_x
+        self.origin_y = space.origin_y
+        self.colonies = tuple(ColonySnapshot(col) for col in space.colonies)
+
+
+
+class Simulation:
+    """
+    Simulation of the space in the background thread
+
+    Keeps the space, the engine updating it, delay between days (0 means
+    days are changed as fast as the engine allows) and the ring buffer
+    of snapshots.
+    """
+    __slots__ = ("space", "engine", "delay", "ring", "thread", "lock",
+                 "wake", "stopped")
+
+    def __init__(self, space, delay = 1.0, engine = "python",
+                 size = RING_SIZE):
+        self.space = space
+        self.engine = engine
+        self.delay = delay
+        self.ring = collections.deque([Snapshot(space)], maxlen = size)
+        self.thread = threading.Thread(target = self.loop, daemon = True)
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = False
+
+    def start(self):
+        """
+        Starts the simulation thread
+        """
+        self.thread.start()
+        logging.info("Simulation of the space [%s] started.",
+                     self.space.name)
+
+    def stop(self):
+        """
+        Stops the simulation thread and waits for its end
+        """
+        self.stopped = True
+        self.wake.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def set_delay(self, delay):
+        """
+        Sets delay between days in seconds
+
+        The current wait for the next day is restarted with the new delay.
+        """
+        self.delay = delay
+        self.wake.set()
+
+    def latest(self):
+        """
+        Returns the newest snapshot of the space
+        """
+        with self.lock:
+            return self.ring[-1]
+
+    def loop(self):
+        """
+        Changes days of the space until it is stopped or has no colonies
+        """
+        start = time.perf_counter()
+        while not self.stopped and len(self.space.colonies) > 0:
+            # Дождаться очередного дня, пробуждаясь при изменении задержки
+            wait = self.delay - (time.perf_counter() - start)
+            if wait > 0:
+                self.wake.wait(wait)
+                self.wake.clear()
+                continue
+            start = time.perf_counter()
+
+            colony.next_day(self.space, self.engine)
+            snap = Snapshot(self.space)
+            with self.lock:
+                self.ring.append(snap)
+        self.stopped = True
+        logging.info("Simulation of the space [%s] stopped on %d day.",
+                     self.space.name, self.space.age)
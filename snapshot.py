@@ -0,0 +1,308 @@
+# snapshot.py
+#
+# EnesGUL12, dr-dobermann, 2018.
+#
+# https://github.com/EnesGUL12/LifeCells.git
+#
+# Двоичные снимки пространства из библиотеки colony.py
+#
+# В отличие от LCSF снимок сохраняет все состояние пространства: день
+# пространства, его начало отсчета, номера и возраст колоний и возраст
+# каждой клетки, поэтому загруженное пространство продолжает изменяться
+# так же, как сохраненное.
+#
+# Файл снимка состоит из трех частей:
+#   заголовок - сигнатура, длина имени пространства, возраст пространства,
+#               начало отсчета и число колоний, за которыми следует имя
+#               пространства в UTF-8;
+#   таблица   - заголовки колоний: номер, возраст, x, y, w, h и смещение
+#               клеток колонии от начала плоскостей;
+#   плоскости - возраст клеток окон колоний построчно, по 4 байта
+#               на клетку.
+# Все числа записываются в порядке байтов little-endian.
+# Файл отображается в память, а клетки каждой колонии копируются в ее
+# массив целиком, без разбора отдельных клеток.
+#
+# Долгий расчет пространства может сохранять снимки в каталог контрольных
+# точек (look Checkpoints). Состояние пространства копируется в памяти,
+# а в файл записывается в отдельном потоке, поэтому расчет не ожидает
+# записи. Снимок записывается во временный файл, который затем атомарно
+# переименовывается, поэтому в каталоге не бывает недописанных снимков.
+
+import concurrent.futures
+import glob
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+import colony
+
+
+# Сигнатура файла снимка
+MAGIC = b"LCSNAP01"
+
+# Заголовок снимка и заголовок колонии в таблице
+HEADER = struct.Struct("<8sIqqqQ")
+COLONY = struct.Struct("<qqqqIIQ")
+
+# Размер клетки в плоскостях
+CELL_BYTES = 4
+
+
+
+class Checkpoints:
+    """
+    Periodic snapshots of the running space
+
+    Keeps the directory of the snapshots, the number of days between
+    them, the number of the newest snapshots kept in the directory,
+    the thread writing them and the costs of the snapshots.
+    """
+    __slots__ = ("directory", "interval", "keep", "writer", "pending",
+                 "count", "capture_time", "write_time", "size")
+
+    def __init__(self, directory, interval, keep = 3):
+        if keep < 1:
+            raise ValueError("At least one checkpoint should be kept, " \
+                             "not {}".format(keep))
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.writer = concurrent.futures.ThreadPoolExecutor(1)
+        self.pending = None
+        self.count = 0
+        self.capture_time = 0.0
+        self.write_time = 0.0
+        self.size = 0
+
+    def check(self, space):
+        """
+        Saves the snapshot of the space if its day has come
+
+        The space is copied in memory and written into the file by
+        the writer thread. If the previous snapshot is still being written,
+        it is waited for.
+        """
+        if space.age % self.interval != 0:
+            return
+
+        start = time.perf_counter()
+        self.wait()
+        state = capture(space)
+        self.capture_time += time.perf_counter() - start
+        path = os.path.join(self.directory,
+                            "{}-{:09d}.lcsnap".format(space.name, space.age))
+        self.pending = self.writer.submit(self.save, state, path)
+
+    def save(self, state, path):
+        """
+        Writes captured state of the space into the directory
+
+        Old snapshots of the space are removed.
+        """
+        start = time.perf_counter()
+        size = write(state, path)
+        seconds = time.perf_counter() - start
+        self.count += 1
+        self.write_time += seconds
+        self.size += size
+        logging.info("Checkpoint [%s] of %d bytes is written in %.3f " \
+                     "seconds.", path, size, seconds)
+
+        names = sorted(glob.glob(pattern(self.directory, state[0])))
+        for name in names[:-self.keep]:
+            os.remove(name)
+
+    def wait(self):
+        """
+        Waits for the snapshot being written
+        """
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def close(self):
+        """
+        Waits for the last snapshot and reports costs of the snapshots
+        """
+        self.wait()
+        self.writer.shutdown()
+        logging.info("%d checkpoints of %d bytes: %.3f seconds of " \
+                     "the simulation stalls, %.3f seconds of writing.",
+                     self.count, self.size, self.capture_time,
+                     self.write_time)
+
+
+
+def capture(space):
+    """
+    Copies the state of the space for saving
+
+    Returns (name, age, origin_x, origin_y, colonies), where colonies is
+    the list of (id, age, x, y, w, h, cells) of the colonies
+    """
+    return (space.name, space.age, space.origin_x, space.origin_y,
+            [(col.id, col.age, col.x, col.y, col.w, col.h,
+              colony.copy_cells(col))
+             for col in space.colonies if col.age >= 0])
+
+
+
+def dump(state, f):
+    """
+    Writes captured state of the space as the snapshot into the file object
+    """
+    name, age, origin_x, origin_y, cols = state
+    name = name.encode("utf-8")
+    f.write(HEADER.pack(MAGIC, len(name), age, origin_x, origin_y,
+                        len(cols)))
+    f.write(name)
+
+    offset = 0
+    for col_id, col_age, x, y, w, h, cells in cols:
+        f.write(COLONY.pack(col_id, col_age, x, y, w, h, offset))
+        offset += w * h
+
+    for col_id, col_age, x, y, w, h, cells in cols:
+        if sys.byteorder != "little":
+            cells = array(cells.typecode, cells)
+            cells.byteswap()
+        cells.tofile(f)
+
+
+
+def write(state, path):
+    """
+    Writes captured state of the space into the snapshot file
+
+    The snapshot is written into the temporary file, which replaces
+    the snapshot file only after it is completely written.
+
+    Returns the size of the snapshot in bytes
+    """
+    temp = path + ".tmp"
+    with open(temp, "wb") as f:
+        dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(temp, path)
+
+    return size
+
+
+
+def save(space, path):
+    """
+    Saves the space into the snapshot file
+    """
+    start = time.perf_counter()
+    write(capture(space), path)
+    logging.info("Space [%s] is saved into [%s] in %.3f seconds.",
+                 space.name, path, time.perf_counter() - start)
+
+
+
+def load(path):
+    """
+    Loads the space from the snapshot file
+
+    ValueError is raised if the file is not a complete snapshot.
+
+    Returns new space
+    """
+    start = time.perf_counter()
+    with open(path, "rb") as f, \
+         mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm, \
+         memoryview(mm) as view:
+        space = read(view, path)
+    logging.info("Space [%s] of %d colonies is loaded from [%s] in %.3f " \
+                 "seconds.", space.name, len(space.colonies), path,
+                 time.perf_counter() - start)
+
+    return space
+
+
+
+def read(view, source):
+    """
+    Builds the space from the snapshot in the memory view
+
+    source is the name of the snapshot for error messages. ValueError is
+    raised if the view is not a complete snapshot.
+
+    Returns new space
+    """
+    magic, size, age, origin_x, origin_y, count = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("[{}] is not a space snapshot".format(source))
+
+    pos = HEADER.size
+    space = colony.Space(bytes(view[pos:pos + size]).decode("utf-8"))
+    space.age = age
+    space.origin_x, space.origin_y = origin_x, origin_y
+    pos += size
+
+    planes = pos + count * COLONY.size
+    table = list(COLONY.iter_unpack(view[pos:planes]))
+    cells_count = sum(w * h for col_id, col_age, x, y, w, h, offset
+                      in table)
+    if len(view) != planes + cells_count * CELL_BYTES:
+        raise ValueError("Snapshot [{}] is damaged".format(source))
+
+    for col_id, col_age, x, y, w, h, offset in table:
+        col = colony.Colony(x, y, col_id, col_age)
+        cells = colony.empty_cells(0)
+        begin = planes + offset * CELL_BYTES
+        cells.frombytes(view[begin:begin + w * h * CELL_BYTES])
+        if sys.byteorder != "little":
+            cells.byteswap()
+        col.set_cells(cells, w, h)
+        space.colonies.append(col)
+
+    return space
+
+
+
+def pattern(directory, name = None):
+    """
+    Returns glob pattern of the checkpoints of the space in the directory
+
+    Checkpoints are named by the space and its day (look Checkpoints).
+    If name is None, checkpoints of all the spaces are matched.
+    """
+    if name is None:
+        return os.path.join(glob.escape(directory), "*.lcsnap")
+
+    # Снимки других пространств, чье имя начинается с имени этого
+    # пространства, не подходят
+    return os.path.join(glob.escape(directory),
+                        glob.escape(name) + "-" + "[0-9]" * 9 + ".lcsnap")
+
+
+
+def latest(directory, name = None):
+    """
+    Loads the newest valid snapshot from the directory
+
+    Only the snapshots of the space with given name are tried, all
+    the snapshots if name is None. Snapshots are tried from the newest
+    to the oldest one (by the day of the space). Damaged snapshots are
+    skipped.
+
+    Returns the space or None if there is no valid snapshot
+    """
+    names = glob.glob(pattern(directory, name))
+    names.sort(key = lambda name: name.rsplit("-", 1)[-1], reverse = True)
+    for name in names:
+        try:
+            return load(name)
+        except (OSError, ValueError, struct.error) as e:
+            logging.error("Checkpoint [%s] is skipped: %s", name, e)
+
+    return None
@@ -0,0 +1,68 @@
+# conftest.py
+#
+# EnesGUL12, dr-dobermann, 2018.
+#
+# https://github.com/EnesGUL12/LifeCells.git
+#
+# Общие функции тестов библиотеки colony.py
+#
+# Тесты сравнивают пространства по их состоянию: месту, размеру и возрасту
+# клеток колоний. Пространства строятся из случайных колоний (супов),
+# поэтому один и тот же номер random.seed дает одно и то же пространство.
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import colony
+
+
+
+def make_soup(seed, count = 8, size = 8, area = 40):
+    """
+    Returns the space of random colonies
+
+    The space has count colonies of up to size * size cells placed in
+    the area * area square, some of them without live cells, and one
+    colony without live cells at all.
+    """
+    random.seed(seed)
+    space = colony.new_space("Soup")
+    for i in range(count):
+        side = random.randrange(1, size)
+        mask = ["".join(random.choice("0001") for x in range(side))
+                for y in range(side)]
+        colony.add_colony(space, mask, random.randrange(area),
+                          random.randrange(area))
+
+    return colony.add_colony(space, ["0"], 5, 5)
+
+
+
+def space_state(space, ages = True):
+    """
+    Returns comparable state of the colonies of the space
+
+    The state is the sorted list of (x, y, w, h, rows) of the colonies.
+    If ages is False, only live cells are compared.
+    """
+    return sorted((col.x, col.y, col.w, col.h,
+                   [[age if ages else min(age, 1) for age in col.row(y)]
+                    for y in range(col.h)])
+                  for col in space.colonies)
+
+
+
+@pytest.fixture
+def soup():
+    return make_soup
+
+
+
+@pytest.fixture
+def state():
+    return space_state
@@ -0,0 +1,36 @@
+# test_engines.py
+#
+# EnesGUL12, dr-dobermann, 2018.
+#
+# https://github.com/EnesGUL12/LifeCells.git
+#
+# Сравнение движков библиотеки colony.py с движком update
+#
+# Каждый движок должен давать тот же результат, что и update, в том числе
+# для колоний без живых клеток и с выключенным замораживанием циклов.
+# Движки без возраста клеток сравниваются только по живым клеткам.
+
+import pytest
+
+import colony
+
+
+SOUPS = 30
+DAYS = 30
+
+
+
+@pytest.mark.parametrize("max_period", [colony.MAX_PERIOD, 0])
+@pytest.mark.parametrize("engine", [name for name in colony.ENGINES
+                                    if name != "python"])
+def test_engine_matches_update(engine, max_period, soup, state,
+                               monkeypatch):
+    monkeypatch.setattr(colony, "MAX_PERIOD", max_period)
+    ages = engine not in colony.AGELESS_ENGINES
+    for seed in range(SOUPS):
+        reference, space = soup(seed), soup(seed)
+        for day in range(1, DAYS + 1):
+            colony.next_day(reference)
+            colony.next_day(space, engine)
+            assert state(space, ages) == state(reference, ages), \
+                   "soup {}, day {}".format(seed, day)
@@ -0,0 +1,125 @@
+# test_formats.py
+#
+# EnesGUL12, dr-dobermann, 2018.
+#
+# https://github.com/EnesGUL12/LifeCells.git
+#
+# Проверка сохранения и загрузки пространства
+#
+# Снимок и журнал сохраняют все состояние пространства, поэтому
+# восстановленное пространство должно совпадать с исходным и изменяться
+# так же, как оно. LCSF сохраняет только живые клетки колоний, поэтому
+# загруженное из него пространство сравнивается по живым клеткам.
+
+import io
+import random
+
+import colony
+import journal
+import snapshot
+
+
+DAYS = 30
+
+# Число, размер и площадь колоний супа: колонии сливаются и выходят за
+# начало отсчета пространства
+SOUP = (30, 16, 120)
+
+
+
+def live_cells(space, origin = True):
+    """
+    Returns live cells of the space as the set of (x, y)
+
+    If origin is True, coordinates are counted from the origin of
+    the space, as LCSF stores them.
+    """
+    x0, y0 = (space.origin_x, space.origin_y) if origin else (0, 0)
+    return {(col.x + x - x0, col.y + y - y0)
+            for col in space.colonies for y in range(col.h)
+            for x, age in enumerate(col.row(y)) if age > 0}
+
+
+
+def test_snapshot_round_trip(tmp_path, soup, state):
+    space = soup(1, *SOUP)
+    for day in range(DAYS):
+        colony.next_day(space, "counts")
+    path = str(tmp_path / "soup.lcsnap")
+    snapshot.save(space, path)
+    loaded = snapshot.load(path)
+
+    assert loaded.name == space.name
+    assert loaded.age == space.age
+    assert (loaded.origin_x, loaded.origin_y) == \
+           (space.origin_x, space.origin_y)
+    assert [(col.id, col.age) for col in loaded.colonies] == \
+           [(col.id, col.age) for col in space.colonies]
+    assert state(loaded) == state(space)
+    for day in range(10):
+        colony.next_day(space)
+        colony.next_day(loaded)
+        assert state(loaded) == state(space)
+
+
+
+def test_journal_rebuilds_every_day(tmp_path, soup, state):
+    space = soup(2, *SOUP)
+    path = str(tmp_path / "soup.lcj")
+    # Ключевые кадры пишутся чаще, чем длится расчет
+    log = journal.Journal(path, space, keyframes = 7)
+    states = {0: (state(space), space.origin_x, space.origin_y)}
+    for day in range(DAYS):
+        colony.next_day(space)
+        states[space.age] = (state(space), space.origin_x, space.origin_y)
+    log.close(space)
+
+    reader = journal.JournalReader(path)
+    assert reader.days() == list(range(DAYS + 1))
+    for day in range(DAYS + 1):
+        rebuilt = reader.space(day)
+        assert rebuilt.age == day
+        assert (state(rebuilt), rebuilt.origin_x, rebuilt.origin_y) == \
+               states[day]
+
+    rebuilt = reader.space(DAYS)
+    for day in range(10):
+        colony.next_day(space)
+        colony.next_day(rebuilt)
+        assert state(rebuilt) == state(space)
+
+
+
+def test_lcsf_round_trip(soup):
+    space = soup(3, *SOUP)
+    for day in range(DAYS):
+        colony.next_day(space)
+    for rle in (True, False):
+        f = io.StringIO()
+        colony.save_to_file(space, f, rle)
+        f.seek(0)
+        loaded = colony.load_stream(f)
+        assert loaded.name == space.name
+        assert live_cells(loaded, False) == live_cells(space)
+
+
+
+def test_rle_mask_over_several_lines():
+    random.seed(4)
+    mask = ["".join(random.choice("01") for x in range(120))
+            for y in range(12)]
+    mask[0] = "1" + mask[0][1:]
+    mask[-1] = mask[-1][:-1] + "1"
+    space = colony.add_colony(colony.new_space("Wide"), mask, 3, 4)
+
+    f = io.StringIO()
+    colony.save_to_file(space, f)
+    lines = f.getvalue().split("Colony:")[1].splitlines()[1:]
+    assert len(lines) > 1
+    assert all(len(line) <= colony.RLE_LINE_LENGTH for line in lines)
+
+    f.seek(0)
+    loaded = colony.load_stream(f)
+    assert live_cells(loaded, False) == live_cells(space)
+    assert colony.rle_rows(colony.rle_mask(mask)) == \
+           [row.rstrip("0") or "0" for row in mask]